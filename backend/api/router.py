@@ -1,6 +1,7 @@
 from typing import Optional
-from fastapi import APIRouter, UploadFile, File, Form, BackgroundTasks, HTTPException, Body
+from fastapi import APIRouter, UploadFile, File, Form, HTTPException, Body, Request
 from fastapi.responses import JSONResponse, FileResponse, StreamingResponse
+from starlette.background import BackgroundTask
 from pydantic import BaseModel
 import shutil
 import os
@@ -8,7 +9,14 @@ import uuid
 import logging
 import json
 import asyncio
-from backend.services.ocr_service import process_pdf_background
+import tempfile
+from backend.services import ocr_service
+from backend.services.ocr_service import count_pages
+from backend.services.scheduler import (
+    scheduler, parse_page_range, resolve_priority, AdmissionRejected, JobTooLarge, BULK
+)
+from backend.services import page_stream, webhooks
+from backend.services.executors import run_db, run_io, run_export
 from backend.database import (
     init_db, create_job, get_job, get_all_jobs, cancel_job, delete_job,
     get_prompts, get_prompt, create_prompt, update_prompt
@@ -20,6 +28,17 @@ UPLOAD_DIR = "data/uploads"
 PROCESSED_DIR = "data/processed"
 logger = logging.getLogger(__name__)
 
+# Uploads are streamed to disk in chunks of this size
+UPLOAD_CHUNK_BYTES = 1024 * 1024
+
+# Only enable behind a trusted proxy that sets (and overwrites) X-Client-Id itself;
+# otherwise any caller could dodge the per-client limit with a random header value
+TRUST_CLIENT_ID_HEADER = os.getenv("OCR_TRUST_CLIENT_ID_HEADER", "0") == "1"
+
+# SSE timing: partial page text is checked every tick, the DB every 500ms
+STREAM_TICK_SECONDS = 0.1
+DB_POLL_TICKS = 5
+
 # Initialize DB on import
 init_db()
 
@@ -27,84 +46,202 @@ class PromptRequest(BaseModel):
     name: str
     content: str
     description: Optional[str] = ""
+    model: Optional[str] = None  # "name" or "name@precision"; None = server default
+
+def resolve_model(ref):
+    """Canonical 'name@precision' for a model reference, 400 if it is not registered."""
+    try:
+        return ocr_service.get_registry().resolve(ref)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
 
 @router.get("/prompts")
 async def list_prompts_endpoint():
-    return get_prompts()
+    return await run_db(get_prompts)
 
 @router.post("/prompts")
 async def create_prompt_endpoint(prompt: PromptRequest):
-    prompt_id = create_prompt(prompt.name, prompt.content, prompt.description)
+    model = resolve_model(prompt.model) if prompt.model else None
+    prompt_id = await run_db(create_prompt, prompt.name, prompt.content, prompt.description, model)
     return {"id": prompt_id, "message": "Prompt created"}
 
 @router.put("/prompts/{prompt_id}")
 async def update_prompt_endpoint(prompt_id: int, prompt: PromptRequest):
-    update_prompt(prompt_id, prompt.name, prompt.content, prompt.description)
+    model = resolve_model(prompt.model) if prompt.model else None
+    await run_db(update_prompt, prompt_id, prompt.name, prompt.content, prompt.description, model)
     return {"message": "Prompt updated"}
 
+@router.get("/models")
+async def list_models():
+    """Registered models with their precision variants, and what is loaded right now"""
+    return await run_io(ocr_service.describe_models)
+
+def client_identity(request: Request):
+    """Client key for per-client admission limits: the remote address (or a proxy-set X-Client-Id)."""
+    if TRUST_CLIENT_ID_HEADER and request.headers.get("X-Client-Id"):
+        return request.headers["X-Client-Id"]
+    return request.client.host if request.client else "unknown"
+
+async def save_upload(file: UploadFile, path: str):
+    """Stream an upload to disk in chunks without blocking the event loop. Returns its size."""
+    size = 0
+    f = await run_io(open, path, "wb")
+    try:
+        while True:
+            chunk = await file.read(UPLOAD_CHUNK_BYTES)
+            if not chunk:
+                break
+            await run_io(f.write, chunk)
+            size += len(chunk)
+    finally:
+        await run_io(f.close)
+    return size
+
+def reject_upload(e: AdmissionRejected):
+    return JSONResponse(
+        status_code=429,
+        content={"detail": e.reason, "retry_after": e.retry_after},
+        headers={"Retry-After": str(e.retry_after)},
+    )
+
 @router.post("/upload")
 async def upload_file(
-    background_tasks: BackgroundTasks, 
+    request: Request,
     file: UploadFile = File(...), 
-    prompt_id: Optional[int] = Form(None)
+    prompt_id: Optional[int] = Form(None),
+    pages: Optional[str] = Form(None),
+    priority: Optional[str] = Form(None),
+    preview_pages: Optional[int] = Form(None),
+    webhook_url: Optional[str] = Form(None),
+    webhook_events: Optional[str] = Form(None),
+    model: Optional[str] = Form(None)
 ):
+    """
+    Queue a PDF for OCR.
+    - pages: page selection such as "1-3,7,10-" (default: all pages)
+    - priority: "interactive" or "bulk" (default: interactive for small selections)
+    - preview_pages: OCR the first N selected pages in the interactive lane, queue the rest as bulk
+    - webhook_url / webhook_events: callback for job.completed, job.failed, job.cancelled
+      and optionally page.completed (comma-separated; default: the three job events)
+    - model: "name" or "name@precision" from /models (default: the prompt's model, else the server default)
+    """
     if not file.filename.endswith(".pdf"):
         raise HTTPException(status_code=400, detail="Only PDF files are allowed")
-    
-    job_id = str(uuid.uuid4())
-    file_location = os.path.join(UPLOAD_DIR, f"{job_id}_{file.filename}")
-    
-    with open(file_location, "wb+") as file_object:
-        file_object.write(file.file.read())
-    
-    # Resolve prompt text
+    if webhook_url:
+        try:
+            await run_io(webhooks.validate_url, webhook_url)  # Resolves the host
+            webhook_events = ",".join(webhooks.parse_events(webhook_events))
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+
+    # Resolve prompt text and model
     used_prompt_text = None
+    prompt_model = None
     if prompt_id:
-        p = get_prompt(prompt_id)
+        p = await run_db(get_prompt, prompt_id)
         if p:
             used_prompt_text = p['content']
+            prompt_model = p.get('model')
+    job_model = resolve_model(model or prompt_model)
+    
+    # Cheap check before anything is written to disk
+    client_id = client_identity(request)
+    try:
+        scheduler.check_admission(client_id)
+    except AdmissionRejected as e:
+        return reject_upload(e)
 
-    # Create job in DB, passing original filename and used prompt
-    create_job(job_id, original_filename=file.filename, used_prompt=used_prompt_text)
+    job_id = str(uuid.uuid4())
+    file_location = os.path.join(UPLOAD_DIR, f"{job_id}_{file.filename}")
+    
+    file_bytes = await save_upload(file, file_location)
+
+    # Resolve page selection and priority class
+    total_pages = await run_io(count_pages, file_location)
+    try:
+        selected_pages = parse_page_range(pages, total_pages)
+        if preview_pages:
+            if preview_pages < 0:
+                raise ValueError("preview_pages must be positive")
+            job_priority = resolve_priority(priority or BULK, len(selected_pages))
+        else:
+            job_priority = resolve_priority(priority, len(selected_pages))
+    except ValueError as e:
+        await run_io(os.remove, file_location)
+        raise HTTPException(status_code=400, detail=str(e))
     
-    # Start background task with optional custom prompt
-    background_tasks.add_task(process_pdf_background, job_id, file_location, used_prompt_text)
+    # Create job in DB, passing original filename and used prompt
+    await run_db(create_job, job_id, original_filename=file.filename, used_prompt=used_prompt_text,
+                 page_range=pages, priority=job_priority, total_pages=total_pages,
+                 webhook_url=webhook_url, webhook_events=webhook_events if webhook_url else None,
+                 model=job_model)
     
-    return {"job_id": job_id, "status": "queued"}
+    # Queue pages on the shared scheduler; admission limits are enforced atomically here
+    try:
+        _, estimate = scheduler.submit(job_id, file_location, used_prompt_text, selected_pages,
+                                       job_priority, total_pages, preview_pages=preview_pages or 0,
+                                       client_id=client_id, file_bytes=file_bytes, model=job_model)
+    except (AdmissionRejected, JobTooLarge) as e:
+        await run_db(delete_job, job_id)
+        await run_io(os.remove, file_location)
+        if isinstance(e, JobTooLarge):
+            # Permanent: no Retry-After, the same job will never fit
+            raise HTTPException(status_code=413, detail=e.reason)
+        return reject_upload(e)
+
+    return {"job_id": job_id, "status": "queued", "priority": job_priority, "model": job_model,
+            "pages": len(selected_pages), **estimate}
+
+@router.get("/jobs/{job_id}/estimate")
+async def job_estimate(job_id: str):
+    """Estimated start/finish for a queued or running job, from the rolling pages/sec"""
+    estimate = scheduler.estimate(job_id)
+    if estimate is None:
+        raise HTTPException(status_code=404, detail="Job is not queued")
+    return estimate
+
+@router.get("/scheduler/stats")
+async def scheduler_stats():
+    """Queue depth and wait time per priority class"""
+    return scheduler.stats()
 
 @router.get("/jobs")
 async def list_jobs():
     """List all jobs history"""
-    return get_all_jobs()
+    return await run_db(get_all_jobs)
 
 @router.get("/status/{job_id}")
 async def get_status(job_id: str):
     """Legacy polling endpoint (optional, kept for compatibility)"""
-    job = get_job(job_id)
+    job = await run_db(get_job, job_id)
     if not job:
         raise HTTPException(status_code=404, detail="Job not found")
     return job
 
 @router.post("/jobs/{job_id}/cancel")
 async def cancel_job_endpoint(job_id: str):
-    job = get_job(job_id)
+    job = await run_db(get_job, job_id)
     if not job:
         raise HTTPException(status_code=404, detail="Job not found")
     
     # Only cancel if actively processing/queued
     if job['status'] in ['processing', 'queued']:
-        cancel_job(job_id)
+        await run_db(cancel_job, job_id)
+        # A job still waiting for a worker is dropped now; a running one stops at the next page
+        if scheduler.discard(job_id):
+            await run_db(webhooks.notify, job_id, webhooks.JOB_CANCELLED)
         return {"message": "Job cancellation requested"}
     
     return {"message": "Job is already completed or cancelled"}
 
 @router.delete("/jobs/{job_id}")
 async def delete_job_endpoint(job_id: str):
-    job = get_job(job_id)
+    job = await run_db(get_job, job_id)
     if not job:
         raise HTTPException(status_code=404, detail="Job not found")
         
-    delete_job(job_id)
+    scheduler.discard(job_id)
+    await run_db(delete_job, job_id)
     # Also try to clean up files if they exist
     # (Optional enhancement: structured file cleanup)
     return {"message": "Job deleted successfully"}
@@ -113,19 +250,36 @@ async def delete_job_endpoint(job_id: str):
 async def stream_status(job_id: str):
     """Server-Sent Events (SSE) endpoint for real-time updates"""
     async def event_generator():
+        last_partial_version = 0
+        ticks = 0
+        job = None
         while True:
-            job = get_job(job_id)
-            if not job:
-                yield f"data: {json.dumps({'error': 'Job not found'})}\n\n"
-                break
-                
-            data = json.dumps(dict(job))
-            yield f"data: {data}\n\n"
-            
-            if job["status"] in ["completed", "error"]:
-                break
-                
-            await asyncio.sleep(0.5) # Poll DB every 500ms without blocking server
+            # Partial page text lives in memory and is checked every tick;
+            # the DB is only polled every DB_POLL_TICKS ticks
+            db_tick = ticks % DB_POLL_TICKS == 0
+            if db_tick:
+                job = await run_db(get_job, job_id)
+                if not job:
+                    yield f"data: {json.dumps({'error': 'Job not found'})}\n\n"
+                    break
+
+            partial = page_stream.broker.get(job_id)
+            partial_changed = partial is not None and partial["version"] != last_partial_version
+
+            if db_tick or partial_changed:
+                payload = dict(job)
+                if partial is not None:
+                    payload["partial"] = {"page": partial["page"], "text": partial["text"]}
+                    last_partial_version = partial["version"]
+
+                data = json.dumps(payload)
+                yield f"data: {data}\n\n"
+
+                if job["status"] in ["completed", "error"]:
+                    break
+
+            ticks += 1
+            await asyncio.sleep(STREAM_TICK_SECONDS) # Without blocking server
 
     return StreamingResponse(event_generator(), media_type="text/event-stream")
 
@@ -133,7 +287,7 @@ async def stream_status(job_id: str):
 async def get_result(job_id: str):
     from backend.database import get_job_pages
     
-    pages = get_job_pages(job_id)
+    pages = await run_db(get_job_pages, job_id)
     # Return as list of dicts: [{ "page_number": 1, "content": "..." }, ...]
     # Remap keys if necessary to match frontend Expectations (currently page.page, page.text)
     # The DB returns row['page_number'] so we map it.
@@ -143,35 +297,111 @@ async def get_result(job_id: str):
         for row in pages
     ]
 
-@router.get("/download/{job_id}/{format}")
-async def download_file(job_id: str, format: str):
-    if format not in ["xlsx", "csv"]:
-        raise HTTPException(status_code=400, detail="Invalid format")
-    
+def build_export_file(job_id: str, format: str):
+    """
+    Write the export file for a job to a private temp file. Returns its path, or None if the
+    job has no pages. The caller deletes the file once it has been sent.
+    """
     # Generate file on-demand from DB (RAM efficient)
     from backend.database import get_job_pages
     import pandas as pd
     
     pages = get_job_pages(job_id)
     if not pages:
-        raise HTTPException(status_code=404, detail="No data found for this job")
+        return None
         
     df = pd.DataFrame(pages)
     
-    # Use output filename
-    filename = f"export_{job_id}.{format}"
-    file_path = os.path.join(PROCESSED_DIR, filename)
-    
-    # Generate file only if requested (or overwrite existing to be safe)
+    # Unique per request: concurrent downloads of the same job must not overwrite each other
+    fd, file_path = tempfile.mkstemp(prefix=f"export_{job_id}_", suffix=f".{format}", dir=PROCESSED_DIR)
+    os.close(fd)
+
     if format == "xlsx":
         df.to_excel(file_path, index=False)
     else:
         df.to_csv(file_path, index=False)
+    return file_path
+
+@router.get("/download/{job_id}/{format}")
+async def download_file(job_id: str, format: str):
+    if format not in ["xlsx", "csv"]:
+        raise HTTPException(status_code=400, detail="Invalid format")
+
+    # Excel generation can take seconds; keep it on the export pool
+    file_path = await run_export(build_export_file, job_id, format)
+    if file_path is None:
+        raise HTTPException(status_code=404, detail="No data found for this job")
         
-    return FileResponse(file_path, filename=filename)
+    return FileResponse(file_path, filename=f"export_{job_id}.{format}",
+                        background=BackgroundTask(os.remove, file_path))
+
+@router.get("/export/bulk")
+async def bulk_export(
+    format: str = "jsonl",
+    since: str = "0",
+    status: str = "completed",
+    job_ids: Optional[str] = None,
+    filename: Optional[str] = None,
+    created_after: Optional[str] = None,
+    batch_size: int = 1000
+):
+    """
+    Stream pages of many jobs, with job metadata, as JSONL, Parquet or Arrow IPC.
+    Jobs are exported in the order they finished, so a long-running job never blocks the sync.
+    - since: X-Export-Cursor from a previous export (incremental sync), or a row's "cursor" to resume
+    - status: comma-separated job statuses ("all" for every status); pages of queued/processing
+      jobs have no cursor and are sent again until their job finishes
+    - job_ids: comma-separated job ids; filename: substring of the original filename
+    - batch_size: rows per DB read, Parquet row group and Arrow record batch
+    """
+    from backend.database import get_export_cursor_bound, iter_export_rows, UNFINISHED_STATUSES
+    from backend.services import bulk_export as exporter
+
+    try:
+        exporter.check_format(format)
+        since_seq, since_page = exporter.parse_cursor(since)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except RuntimeError as e:
+        raise HTTPException(status_code=501, detail=str(e))
+    if not 1 <= batch_size <= 100000:
+        raise HTTPException(status_code=400, detail="batch_size must be between 1 and 100000")
+
+    statuses = None if status == "all" else [s.strip() for s in status.split(",") if s.strip()]
+    include_unfinished = statuses is None or any(s in UNFINISHED_STATUSES for s in statuses)
+
+    # Fix the upper bound before streaming so the returned cursor matches the data sent
+    until = await run_db(get_export_cursor_bound)
+    batches = iter_export_rows(
+        since=since_seq, since_page=since_page, until=until, statuses=statuses,
+        job_ids=[j.strip() for j in job_ids.split(",")] if job_ids else None,
+        filename=filename, created_after=created_after, batch_size=batch_size,
+        include_unfinished=include_unfinished
+    )
+
+    # Sync generators are iterated in a worker thread by StreamingResponse
+    return StreamingResponse(
+        exporter.ENCODERS[format](batches),
+        media_type=exporter.MEDIA_TYPES[format],
+        headers={
+            "X-Export-Cursor": str(max(until, since_seq)),
+            "Content-Disposition": f'attachment; filename="export_since_{since_seq}.{format}"',
+        },
+    )
 
 @router.get("/export/{job_id}")
 async def export_data(job_id: str, format: str = "excel"):
     # Redirect to the new download handler logic
     file_format = "xlsx" if format == "excel" else "csv"
     return await download_file(job_id, file_format)
+
+@router.get("/webhooks/metrics")
+async def webhook_metrics():
+    """Delivery counters and outbox size per status"""
+    return await run_db(webhooks.metrics)
+
+@router.get("/health/loop")
+async def loop_health():
+    """Event loop lag measured by the loop monitor"""
+    from backend.services.loop_monitor import stats
+    return stats
@@ -1,4 +1,5 @@
 import sqlite3
+import sys
 import json
 import os
 import logging
@@ -7,10 +8,28 @@ from datetime import datetime
 DB_PATH = "data/ocr.db"
 logger = logging.getLogger(__name__)
 
+# Statuses a job can still leave; pages of these jobs may not be exported yet
+UNFINISHED_STATUSES = ('queued', 'processing')
+
+# A job takes the next export_seq once, when it moves into a final status (completed, error,
+# cancelled); the bulk export cursor follows it, so a long-running job never holds back finished
+# ones. Rewriting a final status keeps the number (`status` in SET is the row's old value).
+NEXT_EXPORT_SEQ = "(SELECT COALESCE(MAX(export_seq), 0) + 1 FROM jobs)"
+
+def _export_seq_clause(status):
+    if status in UNFINISHED_STATUSES:
+        return "export_seq = NULL"
+    unfinished = ", ".join(f"'{s}'" for s in UNFINISHED_STATUSES)
+    return (f"export_seq = CASE WHEN export_seq IS NULL OR status IN ({unfinished}) "
+            f"THEN {NEXT_EXPORT_SEQ} ELSE export_seq END")
+
 def init_db():
     """Initialize the database with the jobs table."""
     conn = sqlite3.connect(DB_PATH)
     cursor = conn.cursor()
+
+    # WAL lets API readers run while a worker thread is writing page results
+    cursor.execute("PRAGMA journal_mode=WAL")
     
     # Create jobs table if not exists (Basic schema)
     cursor.execute('''
@@ -37,9 +56,23 @@ def init_db():
         print("Migrating: Adding cancelled to jobs")
         cursor.execute("ALTER TABLE jobs ADD COLUMN cancelled BOOLEAN DEFAULT 0")
 
-    # Remove total_pages and current_page if they exist (manual cleanup or more complex migration needed for data)
-    # For simplicity, we're just ensuring they are not in the CREATE TABLE statement above.
-    # If they exist from a previous schema, they will remain unless explicitly dropped.
+    # Page tracking and scheduling columns (progress is over the selected page range)
+    for column, column_type in [
+        ('total_pages', 'INTEGER'),
+        ('current_page', 'INTEGER'),
+        ('page_range', 'TEXT'),
+        ('priority', 'TEXT'),
+        ('started_at', 'TIMESTAMP'),
+        ('completed_at', 'TIMESTAMP'),
+        ('webhook_url', 'TEXT'),
+        ('webhook_events', 'TEXT'),
+        ('failed_pages', 'INTEGER DEFAULT 0'),
+        ('model', 'TEXT'),
+        ('export_seq', 'INTEGER'),
+    ]:
+        if column not in columns:
+            print(f"Migrating: Adding {column} to jobs")
+            cursor.execute(f"ALTER TABLE jobs ADD COLUMN {column} {column_type}")
     
     # Prompts table
     cursor.execute('''
@@ -62,15 +95,13 @@ def init_db():
             ("Default OCR", default_prompt, "Standard DeepSeek-OCR prompt", 1)
         )
 
-    # ... migrations ...
-    if 'original_filename' not in columns:
-        print("Migrating: Adding original_filename to jobs")
-        cursor.execute("ALTER TABLE jobs ADD COLUMN original_filename TEXT")
-        
-    if 'cancelled' not in columns:
-        print("Migrating: Adding cancelled to jobs")
-        cursor.execute("ALTER TABLE jobs ADD COLUMN cancelled BOOLEAN DEFAULT 0")
+    # A prompt may pin the model it was written for (NULL = server default)
+    cursor.execute("PRAGMA table_info(prompts)")
+    if 'model' not in [info[1] for info in cursor.fetchall()]:
+        print("Migrating: Adding model to prompts")
+        cursor.execute("ALTER TABLE prompts ADD COLUMN model TEXT")
 
+    # ... migrations ...
     if 'used_prompt' not in columns:
          print("Migrating: Adding used_prompt to jobs")
          cursor.execute("ALTER TABLE jobs ADD COLUMN used_prompt TEXT")
@@ -87,17 +118,50 @@ def init_db():
         )
     ''')
     cursor.execute("CREATE INDEX IF NOT EXISTS idx_job_pages_job_id ON job_pages(job_id)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_jobs_export_seq ON jobs(export_seq)")
+
+    # Pages that exhausted every inference attempt are kept, marked 'failed'
+    cursor.execute("PRAGMA table_info(job_pages)")
+    if 'status' not in [info[1] for info in cursor.fetchall()]:
+        print("Migrating: Adding status to job_pages")
+        cursor.execute("ALTER TABLE job_pages ADD COLUMN status TEXT DEFAULT 'ok'")
+
+    # Webhook outbox: deliveries survive restarts and are retried with backoff
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS webhook_outbox (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            job_id TEXT,
+            event TEXT,
+            url TEXT,
+            payload TEXT,
+            status TEXT DEFAULT 'pending',  -- pending, sending, delivered, dead
+            attempts INTEGER DEFAULT 0,
+            next_attempt_at REAL,           -- unix time
+            last_error TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            delivered_at TIMESTAMP
+        )
+    ''')
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_webhook_outbox_due ON webhook_outbox(status, next_attempt_at)")
     
     conn.commit()
     conn.close()
 
-def create_job(job_id, original_filename=None, used_prompt=None):
+def now_timestamp():
+    """UTC timestamp in the same format as SQLite's CURRENT_TIMESTAMP."""
+    return datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S")
+
+def create_job(job_id, original_filename=None, used_prompt=None, page_range=None, priority=None,
+               total_pages=None, webhook_url=None, webhook_events=None, model=None):
     """Create a new job with initial status."""
     conn = sqlite3.connect(DB_PATH)
     cursor = conn.cursor()
     cursor.execute(
-        "INSERT INTO jobs (id, status, progress, original_filename, used_prompt) VALUES (?, ?, ?, ?, ?)",
-        (job_id, 'queued', 0, original_filename, used_prompt)
+        """INSERT INTO jobs (id, status, progress, original_filename, used_prompt, page_range, priority,
+        total_pages, webhook_url, webhook_events, model)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""",
+        (job_id, 'queued', 0, original_filename, used_prompt, page_range, priority, total_pages,
+         webhook_url, webhook_events, model)
     )
     conn.commit()
     conn.close()
@@ -124,26 +188,26 @@ def get_prompt(prompt_id):
     conn.close()
     return dict(row) if row else None
 
-def create_prompt(name, content, description=""):
+def create_prompt(name, content, description="", model=None):
     """Create a new prompt."""
     conn = sqlite3.connect(DB_PATH)
     cursor = conn.cursor()
     cursor.execute(
-        "INSERT INTO prompts (name, content, description) VALUES (?, ?, ?)",
-        (name, content, description)
+        "INSERT INTO prompts (name, content, description, model) VALUES (?, ?, ?, ?)",
+        (name, content, description, model)
     )
     prompt_id = cursor.lastrowid
     conn.commit()
     conn.close()
     return prompt_id
 
-def update_prompt(prompt_id, name, content, description=""):
+def update_prompt(prompt_id, name, content, description="", model=None):
     """Update an existing prompt."""
     conn = sqlite3.connect(DB_PATH)
     cursor = conn.cursor()
     cursor.execute(
-        "UPDATE prompts SET name = ?, content = ?, description = ? WHERE id = ?",
-        (name, content, description, prompt_id)
+        "UPDATE prompts SET name = ?, content = ?, description = ?, model = ? WHERE id = ?",
+        (name, content, description, model, prompt_id)
     )
     conn.commit()
     conn.close()
@@ -166,6 +230,8 @@ def update_job(job_id, **kwargs):
     cursor = conn.cursor()
     
     set_clause = ", ".join([f"{key} = ?" for key in kwargs.keys()])
+    if "status" in kwargs:
+        set_clause += ", " + _export_seq_clause(kwargs["status"])
     values = list(kwargs.values())
     values.append(job_id)
     
@@ -178,10 +244,17 @@ def update_job(job_id, **kwargs):
         conn.close()
 
 def cancel_job(job_id):
-    """Mark a job as cancelled."""
+    """
+    Mark a job as cancelled.
+    The export_seq is left to the worker's acknowledgement (ocr_service.mark_cancelled): a page
+    already in inference may still be committed until then.
+    """
     conn = sqlite3.connect(DB_PATH)
     cursor = conn.cursor()
-    cursor.execute("UPDATE jobs SET cancelled = 1, status = 'cancelled' WHERE id = ?", (job_id,))
+    cursor.execute(
+        "UPDATE jobs SET cancelled = 1, status = 'cancelled' WHERE id = ?",
+        (job_id,)
+    )
     conn.commit()
     conn.close()
 
@@ -217,17 +290,61 @@ def get_job(job_id):
         return dict(row)
     return None
 
-def save_page_result(job_id, page_number, content):
+def save_page_result(job_id, page_number, content, status='ok'):
     """Save a single page result to the database."""
     conn = sqlite3.connect(DB_PATH)
     cursor = conn.cursor()
     cursor.execute(
-        "INSERT INTO job_pages (job_id, page_number, content) VALUES (?, ?, ?)",
-        (job_id, page_number, content)
+        "INSERT INTO job_pages (job_id, page_number, content, status) VALUES (?, ?, ?, ?)",
+        (job_id, page_number, content, status)
     )
     conn.commit()
     conn.close()
 
+def increment_failed_pages(job_id):
+    """Count a page that failed every inference attempt."""
+    conn = sqlite3.connect(DB_PATH)
+    cursor = conn.cursor()
+    cursor.execute("UPDATE jobs SET failed_pages = COALESCE(failed_pages, 0) + 1 WHERE id = ?", (job_id,))
+    conn.commit()
+    conn.close()
+
+def get_job_page_numbers(job_id):
+    """Page numbers already committed for a job."""
+    conn = sqlite3.connect(DB_PATH)
+    cursor = conn.cursor()
+    cursor.execute("SELECT page_number FROM job_pages WHERE job_id = ?", (job_id,))
+    numbers = {row[0] for row in cursor.fetchall()}
+    conn.close()
+    return numbers
+
+def get_unfinished_jobs():
+    """Jobs still queued or processing, oldest first (used for recovery after a restart)."""
+    conn = sqlite3.connect(DB_PATH)
+    conn.row_factory = sqlite3.Row
+    cursor = conn.cursor()
+    cursor.execute(
+        f"""SELECT * FROM jobs WHERE status IN ({', '.join('?' * len(UNFINISHED_STATUSES))})
+        AND COALESCE(cancelled, 0) = 0 ORDER BY created_at ASC""",
+        UNFINISHED_STATUSES
+    )
+    rows = cursor.fetchall()
+    conn.close()
+    return [dict(row) for row in rows]
+
+def get_pending_cancellations():
+    """Cancelled jobs no worker has acknowledged yet (still without an export_seq)."""
+    conn = sqlite3.connect(DB_PATH)
+    conn.row_factory = sqlite3.Row
+    cursor = conn.cursor()
+    cursor.execute(
+        """SELECT * FROM jobs WHERE (status = 'cancelled' OR COALESCE(cancelled, 0) = 1)
+        AND export_seq IS NULL ORDER BY created_at ASC"""
+    )
+    rows = cursor.fetchall()
+    conn.close()
+    return [dict(row) for row in rows]
+
 def get_job_pages(job_id):
     """Retrieve all pages for a specific job."""
     conn = sqlite3.connect(DB_PATH)
@@ -247,8 +364,170 @@ def save_result(job_id, result_data):
     conn = sqlite3.connect(DB_PATH)
     cursor = conn.cursor()
     cursor.execute(
-        "UPDATE jobs SET result_json = ?, status = 'completed', progress = 100, message = 'Completed' WHERE id = ?",
+        f"""UPDATE jobs SET result_json = ?, status = 'completed', progress = 100, message = 'Completed',
+        {_export_seq_clause('completed')} WHERE id = ?""",
         (json.dumps(result_data), job_id)
     )
     conn.commit()
     conn.close()
+
+def get_export_cursor_bound():
+    """Highest export_seq handed out so far: every job at or below it has reached a final status."""
+    conn = sqlite3.connect(DB_PATH)
+    cursor = conn.cursor()
+    cursor.execute("SELECT COALESCE(MAX(export_seq), 0) FROM jobs")
+    bound = cursor.fetchone()[0]
+    conn.close()
+    return bound
+
+def iter_export_rows(since=0, since_page=None, until=None, statuses=None, job_ids=None, filename=None,
+                     created_after=None, batch_size=1000, include_unfinished=False):
+    """
+    Yield batches (lists of dicts) of pages joined with their job metadata.
+    Pages of finished jobs come first, ordered by (export_seq, page id) with since < export_seq <= until;
+    `since_page` resumes inside job `since` after that page id (keyset pagination).
+    With `include_unfinished`, pages committed so far by queued/processing jobs follow;
+    they carry no cursor and are sent again until their job finishes.
+    Each batch uses its own short read so the export never holds a long transaction.
+    """
+    filters = []
+    filter_values = []
+    if statuses:
+        filters.append(f"j.status IN ({', '.join('?' * len(statuses))})")
+        filter_values.extend(statuses)
+    if job_ids:
+        filters.append(f"p.job_id IN ({', '.join('?' * len(job_ids))})")
+        filter_values.extend(job_ids)
+    if filename:
+        filters.append("j.original_filename LIKE ?")
+        filter_values.append(f"%{filename}%")
+    if created_after:
+        filters.append("j.created_at >= ?")
+        filter_values.append(created_after)
+
+    columns = """p.id AS page_id, j.export_seq, p.job_id, p.page_number, p.content, p.status AS page_status,
+               p.created_at AS page_created_at,
+               j.original_filename, j.used_prompt, j.status AS job_status, j.priority,
+               j.created_at AS job_created_at, j.started_at, j.completed_at"""
+
+    def read(query, params):
+        conn = sqlite3.connect(DB_PATH)
+        conn.row_factory = sqlite3.Row
+        cursor = conn.cursor()
+        cursor.execute(query, params)
+        rows = []
+        for row in cursor.fetchall():
+            row = dict(row)
+            seq = row.pop("export_seq")
+            rows.append({"cursor": f"{seq}:{row['page_id']}" if seq is not None else None, **row})
+        conn.close()
+        return rows
+
+    # Finished jobs, in the order they finished
+    finished_filters = ["j.export_seq IS NOT NULL", "(j.export_seq > ? OR (j.export_seq = ? AND p.id > ?))"]
+    if until is not None:
+        finished_filters.append("j.export_seq <= ?")
+    query = f"""
+        SELECT {columns}
+        FROM job_pages p JOIN jobs j ON j.id = p.job_id
+        WHERE {' AND '.join(finished_filters + filters)}
+        ORDER BY j.export_seq ASC, p.id ASC
+        LIMIT ?
+    """
+    last_seq = since
+    last_page = since_page if since_page is not None else sys.maxsize
+    while True:
+        bounds = [last_seq, last_seq, last_page] + ([until] if until is not None else [])
+        rows = read(query, bounds + filter_values + [batch_size])
+        if rows:
+            yield rows
+        if len(rows) < batch_size:
+            break
+        last_seq, last_page = (int(part) for part in rows[-1]["cursor"].split(":"))
+
+    if not include_unfinished:
+        return
+
+    query = f"""
+        SELECT {columns}
+        FROM job_pages p JOIN jobs j ON j.id = p.job_id
+        WHERE {' AND '.join(["j.export_seq IS NULL", "p.id > ?"] + filters)}
+        ORDER BY p.id ASC
+        LIMIT ?
+    """
+    last_id = 0
+    while True:
+        rows = read(query, [last_id] + filter_values + [batch_size])
+        if rows:
+            yield rows
+        if len(rows) < batch_size:
+            return
+        last_id = rows[-1]["page_id"]
+
+def enqueue_webhook(job_id, event, url, payload, next_attempt_at):
+    """Add a delivery to the webhook outbox."""
+    conn = sqlite3.connect(DB_PATH)
+    cursor = conn.cursor()
+    cursor.execute(
+        "INSERT INTO webhook_outbox (job_id, event, url, payload, next_attempt_at) VALUES (?, ?, ?, ?, ?)",
+        (job_id, event, url, payload, next_attempt_at)
+    )
+    webhook_id = cursor.lastrowid
+    conn.commit()
+    conn.close()
+    return webhook_id
+
+def claim_due_webhooks(now, limit):
+    """Atomically move up to `limit` due deliveries from 'pending' to 'sending' and return them."""
+    conn = sqlite3.connect(DB_PATH)
+    conn.row_factory = sqlite3.Row
+    cursor = conn.cursor()
+    cursor.execute("BEGIN IMMEDIATE")
+    cursor.execute(
+        """SELECT * FROM webhook_outbox WHERE status = 'pending' AND next_attempt_at <= ?
+        ORDER BY next_attempt_at ASC LIMIT ?""",
+        (now, limit)
+    )
+    rows = [dict(row) for row in cursor.fetchall()]
+    cursor.executemany("UPDATE webhook_outbox SET status = 'sending' WHERE id = ?", [(row['id'],) for row in rows])
+    conn.commit()
+    conn.close()
+    return rows
+
+def update_webhook(webhook_id, **kwargs):
+    """Update outbox fields (status, attempts, next_attempt_at, last_error, delivered_at)."""
+    conn = sqlite3.connect(DB_PATH)
+    cursor = conn.cursor()
+    set_clause = ", ".join([f"{key} = ?" for key in kwargs.keys()])
+    cursor.execute(f"UPDATE webhook_outbox SET {set_clause} WHERE id = ?", list(kwargs.values()) + [webhook_id])
+    conn.commit()
+    conn.close()
+
+def requeue_sending_webhooks():
+    """Deliveries left in 'sending' by a crash or restart go back to the queue."""
+    conn = sqlite3.connect(DB_PATH)
+    cursor = conn.cursor()
+    cursor.execute("UPDATE webhook_outbox SET status = 'pending' WHERE status = 'sending'")
+    conn.commit()
+    conn.close()
+
+def prune_webhooks(before):
+    """Delete delivered and dead outbox rows created before `before` (CURRENT_TIMESTAMP format)."""
+    conn = sqlite3.connect(DB_PATH)
+    cursor = conn.cursor()
+    cursor.execute(
+        "DELETE FROM webhook_outbox WHERE status IN ('delivered', 'dead') AND created_at < ?", (before,)
+    )
+    deleted = cursor.rowcount
+    conn.commit()
+    conn.close()
+    return deleted
+
+def get_webhook_counts():
+    """Number of outbox rows per status."""
+    conn = sqlite3.connect(DB_PATH)
+    cursor = conn.cursor()
+    cursor.execute("SELECT status, COUNT(*) FROM webhook_outbox GROUP BY status")
+    counts = dict(cursor.fetchall())
+    conn.close()
+    return counts
@@ -1,4 +1,5 @@
 import os
+import asyncio
 from fastapi import FastAPI
 import logging
 import sys
@@ -34,6 +35,29 @@ async def startup_event():
     from backend import database
     database.init_db()
 
+    # The scheduler queue is in memory: pick up jobs the previous run left unfinished
+    from backend.api.router import UPLOAD_DIR
+    from backend.services import ocr_service
+    from backend.services.scheduler import scheduler
+    from backend.services.executors import run_db
+    await run_db(ocr_service.recover_jobs, scheduler, UPLOAD_DIR)
+
+    # Log anything that blocks the event loop (SSE streams and requests share it)
+    from backend.services.loop_monitor import monitor_event_loop
+    app.state.loop_monitor = asyncio.create_task(monitor_event_loop())
+
+    # Deliver queued webhooks, including ones left over from a previous run
+    from backend.services.webhooks import dispatcher
+    dispatcher.start()
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    app.state.loop_monitor.cancel()
+    from backend.services.webhooks import dispatcher
+    await asyncio.get_running_loop().run_in_executor(None, dispatcher.stop)
+    from backend.services import executors
+    executors.shutdown()
+
 # Include API Router
 app.include_router(router, prefix="/api")
 
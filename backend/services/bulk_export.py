@@ -0,0 +1,141 @@
+import json
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Column order shared by every export format
+EXPORT_COLUMNS = [
+    ("cursor", "string"),
+    ("page_id", "int64"),
+    ("job_id", "string"),
+    ("page_number", "int32"),
+    ("content", "string"),
+    ("page_status", "string"),
+    ("page_created_at", "string"),
+    ("original_filename", "string"),
+    ("used_prompt", "string"),
+    ("job_status", "string"),
+    ("priority", "string"),
+    ("job_created_at", "string"),
+    ("started_at", "string"),
+    ("completed_at", "string"),
+]
+
+MEDIA_TYPES = {
+    "jsonl": "application/x-ndjson",
+    "parquet": "application/vnd.apache.parquet",
+    "arrow": "application/vnd.apache.arrow.stream",
+}
+
+
+class _ChunkSink:
+    """Write-only file object that hands written bytes back to the streaming generator."""
+
+    def __init__(self):
+        self.chunks = []
+        self.position = 0
+        self.closed = False
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def drain(self):
+        data = b"".join(self.chunks)
+        self.chunks.clear()
+        return data
+
+
+def _arrow():
+    """Import pyarrow lazily; it is only needed for the columnar formats."""
+    try:
+        import pyarrow
+        return pyarrow
+    except ImportError:
+        raise RuntimeError("pyarrow is not installed; use format=jsonl or install pyarrow")
+
+
+def _schema(pa):
+    return pa.schema([(name, getattr(pa, type_name)()) for name, type_name in EXPORT_COLUMNS])
+
+
+def _record_batch(pa, schema, rows):
+    columns = [[row[name] for row in rows] for name, _ in EXPORT_COLUMNS]
+    return pa.RecordBatch.from_arrays(
+        [pa.array(values, type=field.type) for values, field in zip(columns, schema)],
+        schema=schema,
+    )
+
+
+def iter_jsonl(batches):
+    for rows in batches:
+        yield "".join(json.dumps(row, ensure_ascii=False) + "\n" for row in rows).encode("utf-8")
+
+
+def iter_parquet(batches):
+    """One Parquet row group per DB batch; bytes are yielded as each row group is written."""
+    pa = _arrow()
+    import pyarrow.parquet as pq
+
+    schema = _schema(pa)
+    sink = _ChunkSink()
+    writer = pq.ParquetWriter(pa.PythonFile(sink, mode="w"), schema)
+    for rows in batches:
+        writer.write_batch(_record_batch(pa, schema, rows), row_group_size=len(rows))
+        yield sink.drain()
+    writer.close()
+    yield sink.drain()
+
+
+def iter_arrow(batches):
+    """Arrow IPC stream format, one record batch per DB batch."""
+    pa = _arrow()
+
+    schema = _schema(pa)
+    sink = _ChunkSink()
+    writer = pa.ipc.new_stream(pa.PythonFile(sink, mode="w"), schema)
+    for rows in batches:
+        writer.write_batch(_record_batch(pa, schema, rows))
+        yield sink.drain()
+    writer.close()
+    yield sink.drain()
+
+
+ENCODERS = {
+    "jsonl": iter_jsonl,
+    "parquet": iter_parquet,
+    "arrow": iter_arrow,
+}
+
+
+def parse_cursor(value):
+    """
+    Parse an export cursor: "N" (X-Export-Cursor, every job up to export_seq N was sent)
+    or "N:P" (a row's cursor, to resume after page id P of job N). Returns (N, P or None).
+    """
+    try:
+        seq, _, page_id = (value or "0").partition(":")
+        seq, page_id = int(seq), int(page_id) if page_id else None
+    except ValueError:
+        raise ValueError(f"Invalid cursor '{value}', expected 'N' or 'N:P'")
+    if seq < 0 or (page_id is not None and page_id < 0):
+        raise ValueError(f"Invalid cursor '{value}'")
+    return seq, page_id
+
+
+def check_format(format):
+    """Validate the format up front so errors are reported before streaming starts."""
+    if format not in ENCODERS:
+        raise ValueError(f"Invalid format '{format}', expected one of {sorted(ENCODERS)}")
+    if format != "jsonl":
+        _arrow()
@@ -0,0 +1,39 @@
+import os
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+
+# Bounded pools for blocking work called from async handlers.
+# Separate pools keep a burst of slow exports from starving quick DB reads.
+DB_WORKERS = int(os.getenv("OCR_DB_WORKERS", "8"))
+IO_WORKERS = int(os.getenv("OCR_IO_WORKERS", "4"))
+EXPORT_WORKERS = int(os.getenv("OCR_EXPORT_WORKERS", "2"))
+
+db_executor = ThreadPoolExecutor(max_workers=DB_WORKERS, thread_name_prefix="db")
+io_executor = ThreadPoolExecutor(max_workers=IO_WORKERS, thread_name_prefix="io")
+export_executor = ThreadPoolExecutor(max_workers=EXPORT_WORKERS, thread_name_prefix="export")
+
+
+async def _run(executor, fn, *args, **kwargs):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(executor, functools.partial(fn, *args, **kwargs))
+
+
+async def run_db(fn, *args, **kwargs):
+    """Run a blocking sqlite call off the event loop."""
+    return await _run(db_executor, fn, *args, **kwargs)
+
+
+async def run_io(fn, *args, **kwargs):
+    """Run blocking file / subprocess work (uploads, pdfinfo) off the event loop."""
+    return await _run(io_executor, fn, *args, **kwargs)
+
+
+async def run_export(fn, *args, **kwargs):
+    """Run CPU-heavy export generation (pandas / openpyxl) off the event loop."""
+    return await _run(export_executor, fn, *args, **kwargs)
+
+
+def shutdown():
+    for executor in (db_executor, io_executor, export_executor):
+        executor.shutdown(wait=False)
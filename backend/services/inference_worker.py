@@ -0,0 +1,276 @@
+import os
+import time
+import inspect
+import logging
+import multiprocessing
+from contextlib import contextmanager
+
+from backend.services.page_stream import PageTextStreamer, TokenLimitExceeded, broker
+from backend.services.model_registry import import_factory
+
+logger = logging.getLogger(__name__)
+
+# Partial text is sent to the parent every N tokens (one pipe message each)
+PARTIAL_EVERY_TOKENS = 4
+
+
+class InferenceError(Exception):
+    """Inference failed or the worker process died."""
+
+
+class InferenceTimeout(InferenceError):
+    """A page (or the model load) exceeded its wall-clock budget."""
+
+
+def supports_streamer(infer_fn):
+    """Check whether the backend's infer() accepts a `streamer` argument."""
+    try:
+        params = inspect.signature(infer_fn).parameters
+    except (TypeError, ValueError):
+        return False
+    return "streamer" in params or any(
+        p.kind == inspect.Parameter.VAR_KEYWORD for p in params.values()
+    )
+
+
+def read_result(page_output_dir):
+    """DeepSeek-OCR's infer() may return None and write 'result.mmd' instead."""
+    root_mmd = os.path.join(page_output_dir, "result.mmd")
+    sub_mmd = os.path.join(page_output_dir, "to_markdown", "result.mmd")
+
+    if os.path.exists(root_mmd):
+        with open(root_mmd, 'r') as f: return f.read()
+    if os.path.exists(sub_mmd):
+        with open(sub_mmd, 'r') as f: return f.read()
+    files = os.listdir(page_output_dir)
+    md_files = [f for f in files if f.endswith('.md') or f.endswith('.mmd')]
+    if md_files:
+        with open(os.path.join(page_output_dir, md_files[0]), 'r') as f: return f.read()
+    return None
+
+
+@contextmanager
+def generate_hook(model, streamer, inject_streamer=True):
+    """
+    Wrap model.generate() for the duration of one infer() call.
+    DeepSeek-OCR's infer() takes no streamer argument but calls self.generate() internally:
+    the wrapper injects the streamer and caps max_new_tokens at the streamer's max_tokens,
+    so the token limit holds whether or not partial text is streamed.
+    """
+    original = getattr(model, "generate", None)
+    if streamer is None or original is None:
+        yield
+        return
+
+    def generate(*args, **kwargs):
+        if inject_streamer:
+            kwargs["streamer"] = streamer
+        if streamer.max_tokens:
+            # One token past the cap, so the streamer sees the overrun and raises
+            limit = streamer.max_tokens + 1
+            kwargs["max_new_tokens"] = min(kwargs.get("max_new_tokens") or limit, limit)
+        return original(*args, **kwargs)
+
+    own = vars(model).get("generate")
+    model.generate = generate
+    try:
+        yield
+    finally:
+        if own is None:
+            del model.generate  # Back to the class method
+        else:
+            model.generate = own
+
+
+def run_infer(model, tokenizer, image_path, output_dir, prompt, settings, streamer=None):
+    """
+    Run model.infer() for one page image and return its text.
+    `streamer` publishes partial text and/or enforces its max_tokens (see PageTextStreamer).
+    """
+    infer_kwargs = dict(
+        prompt=prompt,
+        image_file=image_path,
+        output_path=output_dir,  # Save to unique dir
+        base_size=settings["base_size"],
+        image_size=settings["image_size"],
+        crop_mode=settings["crop_mode"],
+        save_results=True,
+        test_compress=False
+    )
+    via_infer = streamer is not None and supports_streamer(model.infer)
+    if via_infer:
+        infer_kwargs["streamer"] = streamer
+
+    # Inference using native .infer() method from DeepSeek-OCR
+    with generate_hook(model, streamer, inject_streamer=not via_infer):
+        text = model.infer(tokenizer, **infer_kwargs)
+    if text is None:
+        text = read_result(output_dir)
+    if text is None and streamer is not None and streamer.text:
+        text = streamer.text
+    if text is None:
+        raise InferenceError("Could not find result.mmd in output")
+    return text
+
+
+class _PipeBroker:
+    """Broker stand-in inside the child: partial text goes back to the parent."""
+
+    def __init__(self, conn):
+        self.conn = conn
+
+    def append(self, job_id, page_number, delta):
+        self.conn.send(("partial", delta))
+
+
+def _child_main(conn, registry_factory, streaming):
+    """Worker process: serve one page request at a time, loading models through its registry."""
+    try:
+        registry = import_factory(registry_factory)()
+    except Exception as e:
+        conn.send(("load_error", f"{type(e).__name__}: {e}"))
+        return
+    conn.send(("ready", None))
+
+    while True:
+        try:
+            request = conn.recv()
+        except EOFError:
+            return
+        if request is None:
+            return
+
+        try:
+            if not registry.is_loaded(request["model"]):
+                # Tell the parent, so model load time is not billed to the page budget
+                conn.send(("loading", request["model"]))
+                registry.get(request["model"])
+                conn.send(("loaded", registry.metrics()))
+            model, tokenizer = registry.get(request["model"])
+        except Exception as e:
+            conn.send(("load_error", f"{type(e).__name__}: {e}"))
+            continue
+
+        # Always attached: without streaming it only enforces the token cap
+        streamer = PageTextStreamer(tokenizer, request["job_id"], request["page_number"],
+                                    publish_every=PARTIAL_EVERY_TOKENS,
+                                    broker=_PipeBroker(conn) if streaming else None,
+                                    max_tokens=request["max_tokens"])
+        try:
+            text = run_infer(model, tokenizer, request["image_path"], request["output_dir"],
+                             request["prompt"], request["settings"], streamer)
+            conn.send(("result", text))
+        except TokenLimitExceeded as e:
+            conn.send(("token_limit", str(e)))
+        except Exception as e:
+            conn.send(("error", f"{type(e).__name__}: {e}"))
+
+
+class SupervisedInference:
+    """
+    Runs model.infer() in a child process with a wall-clock budget per page.
+    On timeout the child is killed; the next call starts a fresh one, reloading the model.
+    Not thread-safe: use one instance per scheduler worker.
+    """
+
+    def __init__(self, registry_factory, load_timeout, streaming=True, broker=broker):
+        self.registry_factory = registry_factory
+        self.load_timeout = load_timeout
+        self.streaming = streaming
+        self.broker = broker
+        self.restarts = 0
+        # Latest registry metrics reported by the child
+        self.model_metrics = None
+        self._proc = None
+        self._conn = None
+
+    def _start(self):
+        ctx = multiprocessing.get_context("spawn")  # CUDA cannot be used after fork
+        parent_conn, child_conn = ctx.Pipe()
+        proc = ctx.Process(target=_child_main, args=(child_conn, self.registry_factory, self.streaming),
+                           name="ocr-inference", daemon=True)
+        logger.info("Starting inference worker process...")
+        proc.start()
+        child_conn.close()
+        self._proc, self._conn = proc, parent_conn
+
+        if not parent_conn.poll(self.load_timeout):
+            self.kill()
+            raise InferenceTimeout(f"Worker start exceeded {self.load_timeout}s")
+        try:
+            kind, detail = parent_conn.recv()
+        except EOFError:
+            kind, detail = "load_error", "worker exited during start"
+        if kind != "ready":
+            self.kill()
+            raise InferenceError(f"Worker start failed: {detail}")
+        logger.info(f"Inference worker ready (pid {proc.pid})")
+
+    def kill(self):
+        if self._proc is not None:
+            self._proc.kill()
+            self._proc.join()
+        if self._conn is not None:
+            self._conn.close()
+        self._proc = self._conn = None
+
+    def stop(self):
+        if self._proc is not None and self._proc.is_alive():
+            try:
+                self._conn.send(None)
+                self._proc.join(5)
+            except (BrokenPipeError, OSError):
+                pass
+        self.kill()
+
+    def infer(self, job_id, page_number, image_path, output_dir, prompt, settings, timeout, max_tokens,
+              model_ref=None):
+        if self._proc is None or not self._proc.is_alive():
+            if self._proc is not None:
+                self.kill()
+            self._start()
+
+        self._conn.send({
+            "job_id": job_id,
+            "page_number": page_number,
+            "image_path": image_path,
+            "output_dir": output_dir,
+            "prompt": prompt,
+            "settings": settings,
+            "max_tokens": max_tokens,
+            "model": model_ref,
+        })
+
+        deadline = time.monotonic() + timeout
+        loading = False
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0 or not self._conn.poll(remaining):
+                budget = f"model load exceeded {self.load_timeout}s" if loading else f"page exceeded {timeout}s"
+                logger.error(f"Page {page_number} of job {job_id}: {budget}, restarting inference worker")
+                self.kill()
+                self.restarts += 1
+                raise InferenceTimeout(budget[0].upper() + budget[1:])
+            try:
+                kind, payload = self._conn.recv()
+            except EOFError:
+                self.kill()
+                self.restarts += 1
+                raise InferenceError("Inference worker process died")
+
+            if kind == "loading":
+                loading = True
+                deadline = time.monotonic() + self.load_timeout
+            elif kind == "loaded":
+                # The page budget starts once its model is in memory
+                loading = False
+                self.model_metrics = payload
+                deadline = time.monotonic() + timeout
+            elif kind == "partial":
+                self.broker.append(job_id, page_number, payload)
+            elif kind == "result":
+                return payload
+            elif kind == "token_limit":
+                raise TokenLimitExceeded(payload)
+            else:
+                raise InferenceError(payload)
@@ -0,0 +1,30 @@
+import os
+import time
+import asyncio
+import logging
+
+logger = logging.getLogger(__name__)
+
+# How often the loop is probed and how late a wake-up must be to count as a stall
+INTERVAL_SECONDS = float(os.getenv("OCR_LOOP_MONITOR_INTERVAL", "0.1"))
+STALL_THRESHOLD_SECONDS = float(os.getenv("OCR_LOOP_STALL_THRESHOLD", "0.1"))
+
+stats = {"stalls": 0, "max_lag_seconds": 0.0, "last_lag_seconds": 0.0}
+
+
+async def monitor_event_loop(interval=INTERVAL_SECONDS, threshold=STALL_THRESHOLD_SECONDS):
+    """
+    Sleep for `interval` in a loop and measure how late each wake-up is.
+    A late wake-up means something blocked the event loop thread for that long.
+    """
+    while True:
+        started = time.monotonic()
+        await asyncio.sleep(interval)
+        lag = time.monotonic() - started - interval
+
+        stats["last_lag_seconds"] = lag
+        if lag > stats["max_lag_seconds"]:
+            stats["max_lag_seconds"] = lag
+        if lag > threshold:
+            stats["stalls"] += 1
+            logger.warning(f"Event loop stalled for {lag * 1000:.0f}ms (threshold {threshold * 1000:.0f}ms)")
@@ -0,0 +1,251 @@
+import os
+import gc
+import json
+import time
+import logging
+import threading
+import importlib
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MODEL = "deepseek-ocr"
+DEFAULT_LOADER = "backend.services.ocr_service:load_deepseek"
+
+PRECISIONS = ("bf16", "fp16", "fp32", "int8", "int4")
+BYTES_PER_PARAM = {"bf16": 2, "fp16": 2, "fp32": 4, "int8": 1, "int4": 0.5}
+
+# Limits apply per registry, i.e. per process that holds models: with isolated inference
+# (the default) every scheduler worker has its own process, so OCR_WORKERS workers can use
+# OCR_WORKERS x the budget. Size it as (memory for models) / OCR_WORKERS.
+# 0 disables the memory budget; max_loaded always applies.
+MEMORY_BUDGET_MB = float(os.getenv("OCR_MODEL_MEMORY_BUDGET_MB", "0"))
+MAX_LOADED_MODELS = int(os.getenv("OCR_MAX_LOADED_MODELS", "1"))
+
+
+def default_model_path():
+    """Local copy if present, otherwise the HuggingFace id (same rule as before the registry)."""
+    # Default to local path if not set
+    default_path = "data/models/DeepSeek-OCR"
+    model_path = os.getenv("OCR_MODEL_PATH", default_path)
+    if not os.path.exists(model_path) and model_path == default_path:
+        model_path = "deepseek-ai/DeepSeek-OCR-2"
+    return model_path
+
+
+class ModelSpec:
+    """A named model and the precision variants it can be loaded in."""
+
+    def __init__(self, name, path, loader=DEFAULT_LOADER, precisions=("bf16",), default_precision=None,
+                 params_billions=None, estimated_mb=None, description=""):
+        self.name = name
+        self.path = path
+        # Dotted 'module:function' path or a callable taking (spec, precision) -> (model, tokenizer)
+        self.loader = loader
+        self.precisions = tuple(precisions)
+        self.default_precision = default_precision or self.precisions[0]
+        self.params_billions = params_billions
+        self.estimated_mb = estimated_mb
+        self.description = description
+
+        unknown = [p for p in self.precisions if p not in PRECISIONS]
+        if unknown:
+            raise ValueError(f"Model '{name}': unknown precisions {unknown}, expected any of {list(PRECISIONS)}")
+        if self.default_precision not in self.precisions:
+            raise ValueError(f"Model '{name}': default precision '{self.default_precision}' is not in {self.precisions}")
+
+    def estimate_mb(self, precision):
+        """Expected memory footprint before the model is loaded."""
+        if self.estimated_mb is not None:
+            return float(self.estimated_mb)
+        if self.params_billions is not None:
+            return self.params_billions * 1e9 * BYTES_PER_PARAM[precision] / 1024 ** 2
+        return 0.0
+
+    def to_dict(self):
+        return {
+            "name": self.name,
+            "path": self.path,
+            "precisions": list(self.precisions),
+            "default_precision": self.default_precision,
+            "description": self.description,
+        }
+
+
+def import_factory(path):
+    """Resolve 'package.module:function' to the function."""
+    module_name, _, attr = path.partition(":")
+    return getattr(importlib.import_module(module_name), attr)
+
+
+def parse_model_ref(ref):
+    """'name' or 'name@precision' -> (name, precision or None)."""
+    name, _, precision = (ref or "").partition("@")
+    return name.strip(), precision.strip() or None
+
+
+def measure_mb(model):
+    """Parameter + buffer memory of a torch-style module, or None if it has none."""
+    if not hasattr(model, "parameters"):
+        return None
+    total = sum(p.numel() * p.element_size() for p in model.parameters())
+    if hasattr(model, "buffers"):
+        total += sum(b.numel() * b.element_size() for b in model.buffers())
+    return total / 1024 ** 2
+
+
+def _release_memory():
+    gc.collect()
+    try:
+        import torch
+        if torch.cuda.is_available():
+            torch.cuda.empty_cache()
+    except ImportError:
+        pass
+
+
+class ModelRegistry:
+    """
+    Loads models on demand and keeps them in an LRU cache bounded by `max_loaded`
+    and `memory_budget_mb`. Least recently used models are evicted before a load
+    that would not fit. The lock is not held while a loader runs, so metrics() and
+    cache hits never wait for a load; loads in flight count against the limits.
+    """
+
+    def __init__(self, specs, default_model=DEFAULT_MODEL, memory_budget_mb=0, max_loaded=1):
+        self.specs = {spec.name: spec for spec in specs}
+        if default_model not in self.specs:
+            raise ValueError(f"Default model '{default_model}' is not registered")
+        self.default_model = default_model
+        self.memory_budget_mb = memory_budget_mb
+        self.max_loaded = max(1, max_loaded)
+        self._lock = threading.Lock()
+        self._loaded = OrderedDict()  # canonical ref -> {"model", "tokenizer", "size_mb"}
+        self._loading = {}  # canonical ref -> (threading.Event, reserved MB)
+        self._metrics = {"hits": 0, "loads": 0, "evictions": 0, "load_errors": 0, "load_seconds": {}}
+
+    def resolve(self, ref=None):
+        """Validate a model reference and return its canonical 'name@precision' form."""
+        name, precision = parse_model_ref(ref)
+        name = name or self.default_model
+        spec = self.specs.get(name)
+        if spec is None:
+            raise ValueError(f"Unknown model '{name}', expected one of {sorted(self.specs)}")
+        precision = precision or spec.default_precision
+        if precision not in spec.precisions:
+            raise ValueError(f"Model '{name}' has no '{precision}' variant, expected one of {list(spec.precisions)}")
+        return f"{name}@{precision}"
+
+    def is_loaded(self, ref=None):
+        with self._lock:
+            return self.resolve(ref) in self._loaded
+
+    def get(self, ref=None):
+        """Return (model, tokenizer), loading and evicting as needed."""
+        key = self.resolve(ref)
+        name, precision = parse_model_ref(key)
+        spec = self.specs[name]
+        while True:
+            with self._lock:
+                entry = self._loaded.get(key)
+                if entry is not None:
+                    self._loaded.move_to_end(key)
+                    self._metrics["hits"] += 1
+                    return entry["model"], entry["tokenizer"]
+                loading = self._loading.get(key)
+                if loading is None:
+                    estimate = spec.estimate_mb(precision)
+                    self._make_room(estimate)
+                    done = threading.Event()
+                    self._loading[key] = (done, estimate)
+                    break
+            # Another thread is loading the same model; use its result (or retry if it failed)
+            loading[0].wait()
+
+        logger.info(f"Loading model {key} from {spec.path}...")
+        started = time.monotonic()
+        try:
+            loader = import_factory(spec.loader) if isinstance(spec.loader, str) else spec.loader
+            model, tokenizer = loader(spec, precision)
+        except Exception:
+            with self._lock:
+                self._metrics["load_errors"] += 1
+                del self._loading[key]
+            done.set()
+            raise
+        elapsed = time.monotonic() - started
+
+        size_mb = measure_mb(model)
+        if size_mb is None:
+            size_mb = spec.estimate_mb(precision)
+        with self._lock:
+            del self._loading[key]
+            self._loaded[key] = {"model": model, "tokenizer": tokenizer, "size_mb": size_mb}
+            self._metrics["loads"] += 1
+            self._metrics["load_seconds"][key] = round(elapsed, 3)
+            # The estimate may have been off; trim others if the real size does not fit
+            self._make_room(0, keep=key)
+        done.set()
+        logger.info(f"Model {key} loaded in {elapsed:.1f}s ({size_mb:.0f} MB)")
+        return model, tokenizer
+
+    def evict(self, ref):
+        key = self.resolve(ref)
+        with self._lock:
+            if key in self._loaded:
+                self._evict(key)
+
+    def metrics(self):
+        with self._lock:
+            return {
+                **{k: v for k, v in self._metrics.items() if k != "load_seconds"},
+                "load_seconds": dict(self._metrics["load_seconds"]),
+                "loaded": [{"model": key, "size_mb": round(entry["size_mb"], 1)} for key, entry in self._loaded.items()],
+                "loading": list(self._loading),
+                "used_mb": round(self._used_mb(), 1),
+                "memory_budget_mb": self.memory_budget_mb,
+                "max_loaded": self.max_loaded,
+            }
+
+    # The helpers below are called with the lock held
+
+    def _used_mb(self):
+        reserved = sum(estimate for _, estimate in self._loading.values())
+        return sum(entry["size_mb"] for entry in self._loaded.values()) + reserved
+
+    def _make_room(self, needed_mb, keep=None):
+        def over_limit():
+            count = len(self._loaded) + len(self._loading) + (0 if keep else 1)
+            if count > self.max_loaded:
+                return True
+            return bool(self.memory_budget_mb) and self._used_mb() + needed_mb > self.memory_budget_mb
+
+        while over_limit():
+            candidates = [key for key in self._loaded if key != keep]
+            if not candidates:
+                break
+            self._evict(candidates[0])  # OrderedDict: least recently used first
+
+    def _evict(self, key):
+        entry = self._loaded.pop(key)
+        logger.info(f"Evicting model {key} ({entry['size_mb']:.0f} MB)")
+        del entry
+        self._metrics["evictions"] += 1
+        _release_memory()
+
+
+def specs_from_env():
+    """
+    The default DeepSeek-OCR model plus any models configured in OCR_MODELS, a JSON object:
+    {"name": {"path": "...", "precisions": ["bf16", "int8"], "params_billions": 3, "loader": "module:fn"}}
+    """
+    specs = [ModelSpec(DEFAULT_MODEL, default_model_path(), precisions=("bf16", "fp16", "int8", "int4"),
+                       params_billions=3.0, description="DeepSeek-OCR (OCR_MODEL_PATH)")]
+    for name, config in json.loads(os.getenv("OCR_MODELS", "{}")).items():
+        specs.append(ModelSpec(name, **config))
+    return specs
+
+
+def registry_from_env():
+    return ModelRegistry(specs_from_env(), default_model=os.getenv("OCR_DEFAULT_MODEL", DEFAULT_MODEL),
+                         memory_budget_mb=MEMORY_BUDGET_MB, max_loaded=MAX_LOADED_MODELS)
@@ -10,6 +10,7 @@ logger = logging.getLogger(__name__)
 import os
 import json
 import logging
+import threading
 import torch
 import pdf2image
 from pdf2image import convert_from_path
@@ -19,188 +20,310 @@ import pandas as pd
 
 PROCESSED_DIR = "data/processed"
 
-# Global model cache
-model = None
-tokenizer = None
+def load_deepseek(spec, precision):
+    """Registry loader for DeepSeek-OCR checkpoints (AutoModel + trust_remote_code)."""
+    logger.info(f"Loading model from {spec.path} ({precision})...")
+    
+    try:
+        # 1. Load Tokenizer
+        logger.info("Step 1: Loading Tokenizer...")
+        tokenizer = AutoTokenizer.from_pretrained(spec.path, trust_remote_code=True)
+        logger.info("Step 1: Tokenizer Loaded.")
 
-def load_model():
-    global model, tokenizer
-    if model is None:
-        # Default to local path if not set
-        DEFAULT_PATH = "data/models/DeepSeek-OCR"
-        MODEL_PATH = os.getenv("OCR_MODEL_PATH", DEFAULT_PATH)
-        
-        if not os.path.exists(MODEL_PATH) and MODEL_PATH == DEFAULT_PATH:
-            MODEL_PATH = "deepseek-ai/DeepSeek-OCR-2"
+        # 2. Load Model
+        logger.info("Step 2: Loading Model...")
+        load_kwargs = {}
+        if precision in ("int8", "int4"):
+            from transformers import BitsAndBytesConfig
+            load_kwargs["quantization_config"] = BitsAndBytesConfig(
+                load_in_8bit=precision == "int8",
+                load_in_4bit=precision == "int4",
+                bnb_4bit_compute_dtype=torch.bfloat16,
+            )
+            load_kwargs["torch_dtype"] = torch.bfloat16
+        else:
+            load_kwargs["torch_dtype"] = {"bf16": torch.bfloat16, "fp16": torch.float16, "fp32": torch.float32}[precision]
 
-        logger.info(f"Loading model from {MODEL_PATH}...")
+        model = AutoModel.from_pretrained(
+            spec.path,
+            trust_remote_code=True,
+            use_safetensors=True,
+            device_map="auto",
+            **load_kwargs
+        )
+        # Note: Explicit .cuda().to(bfloat16) is handled by device_map="auto" + torch_dtype
+        logger.info("Step 2: Model Loaded.")
         
-        try:
-            # 1. Load Tokenizer
-            logger.info("Step 1: Loading Tokenizer...")
-            tokenizer = AutoTokenizer.from_pretrained(MODEL_PATH, trust_remote_code=True)
-            logger.info("Step 1: Tokenizer Loaded.")
-
-            # 2. Load Model
-            logger.info("Step 2: Loading Model...")
-            model = AutoModel.from_pretrained(
-                MODEL_PATH,
-                trust_remote_code=True,
-                use_safetensors=True,
-                torch_dtype=torch.bfloat16,
-                device_map="auto" 
-            )
-            # Note: Explicit .cuda().to(bfloat16) is handled by device_map="auto" + torch_dtype
-            logger.info("Step 2: Model Loaded.")
-            
-            model = model.eval() 
-            logger.info("Model loaded successfully.")
-        except Exception as e:
-            logger.error(f"Failed to load model: {e}")
-            raise e
+        model = model.eval() 
+        logger.info("Model loaded successfully.")
+        return model, tokenizer
+    except Exception as e:
+        logger.error(f"Failed to load model: {e}")
+        raise e
 
-from backend.database import update_job, save_result, save_page_result, get_job
+from backend.database import (
+    update_job, save_result, save_page_result, get_job, now_timestamp, increment_failed_pages,
+    get_unfinished_jobs, get_job_page_numbers, get_pending_cancellations
+)
+from backend.services.page_stream import PageTextStreamer, broker
+from backend.services import webhooks
 
-def process_pdf_background(job_id: str, file_path: str, custom_prompt: str = None):
-    """
-    Background task to process the PDF.
-    Now SYNCHRONOUS (def instead of async def) to run in a thread pool.
-    """
+from backend.services.inference_worker import (
+    SupervisedInference, run_infer, supports_streamer, InferenceTimeout
+)
+from backend.services import model_registry as registry_module
+
+# Push partial page text to SSE subscribers while the model generates
+STREAMING_ENABLED = os.getenv("OCR_STREAMING", "1") == "1"
+
+# Watchdog: run inference in a supervised child process with a per-page time budget
+ISOLATE_INFERENCE = os.getenv("OCR_ISOLATE_INFERENCE", "1") == "1"
+PAGE_TIMEOUT_SECONDS = float(os.getenv("OCR_PAGE_TIMEOUT", "300"))
+MODEL_LOAD_TIMEOUT_SECONDS = float(os.getenv("OCR_MODEL_LOAD_TIMEOUT", "900"))
+# Cap on generated tokens per page (enforced through the streamer)
+MAX_TOKENS = int(os.getenv("OCR_MAX_TOKENS", "8192"))
+# Factory for the ModelRegistry that owns the loaded models (in the worker process when isolated)
+MODEL_REGISTRY_FACTORY = os.getenv("OCR_MODEL_REGISTRY", "backend.services.model_registry:registry_from_env")
+
+# Each failed attempt retries the page with cheaper settings (lower resolution, no crop mode)
+PAGE_ATTEMPTS = [
+    {"dpi": 300, "base_size": 1024, "image_size": 768, "crop_mode": True},  # Official example uses 768
+    {"dpi": 200, "base_size": 1024, "image_size": 640, "crop_mode": False},
+    {"dpi": 150, "base_size": 640, "image_size": 640, "crop_mode": False},
+]
+
+# Registry in this process: resolves model names for the API and, when inference
+# is not isolated, also holds the loaded models
+_registry = None
+_registry_lock = threading.Lock()
+
+def get_registry():
+    global _registry
+    with _registry_lock:
+        if _registry is None:
+            _registry = registry_module.import_factory(MODEL_REGISTRY_FACTORY)()
+        return _registry
+
+# One supervised worker process per scheduler thread
+_supervisors = threading.local()
+_all_supervisors = []
+
+def get_supervisor():
+    if not hasattr(_supervisors, "inference"):
+        _supervisors.inference = SupervisedInference(MODEL_REGISTRY_FACTORY, MODEL_LOAD_TIMEOUT_SECONDS,
+                                                     streaming=STREAMING_ENABLED)
+        _all_supervisors.append(_supervisors.inference)
+    return _supervisors.inference
+
+def model_metrics():
+    """Registry metrics of every process that holds models."""
+    if ISOLATE_INFERENCE:
+        return [s.model_metrics for s in _all_supervisors if s.model_metrics]
+    return [get_registry().metrics()]
+
+def describe_models():
+    """Registered models and the state of every registry (for GET /models)."""
+    registry = get_registry()
+    return {
+        "default": registry.resolve(None),
+        "models": [spec.to_dict() for spec in registry.specs.values()],
+        # Memory limits apply per registry: one per worker process when inference is isolated
+        "registry_scope": "per_worker_process" if ISOLATE_INFERENCE else "shared",
+        "registries": model_metrics(),
+    }
+
+DEFAULT_PROMPT = "<image>\n<|grounding|>Convert the document to markdown."
+
+def count_pages(file_path):
+    """Read the PDF page count without rendering any page."""
+    try:
+        info = pdf2image.pdfinfo_from_path(file_path)
+        return info["Pages"]
+    except Exception as e:
+        logger.warning(f"Could not get page count via pdfinfo: {e}, falling back to full read")
+        return 1
+
+def is_job_cancelled(job_id):
+    """True if the job was cancelled or deleted since it was queued."""
+    job_info = get_job(job_id)
+    return not job_info or job_info.get('cancelled') == 1 or job_info.get('status') == 'cancelled'
+
+def mark_cancelled(job_id):
+    logger.info(f"Job {job_id} stopped (Cancelled or Deleted).")
+    if get_job(job_id): # Only update if it still exists
+        update_job(job_id, status="cancelled", message="Cancelled by user")
+        webhooks.notify(job_id, webhooks.JOB_CANCELLED)
+    broker.clear(job_id)
+
+def start_job(job_id, total_pages):
+    """Called once, when the job gets its first worker slot."""
     logger.info(f"Starting processing for job {job_id}")
-    
+    # Models are loaded on first use of each page's model (see get_registry / the worker process)
+    update_job(job_id, status="processing", progress=0, message="Processing",
+               started_at=now_timestamp(), current_page=0, total_pages=total_pages)
+
+def _ocr_page_attempt(job_id, file_path, page_number, prompt, settings, model_ref):
+    """Render the page with `settings` and run one inference attempt. Raises on failure."""
+    i = page_number
+    temp_image_path = os.path.join(PROCESSED_DIR, f"{job_id}_temp_page_{i}.png")
+    # Create unique output directory for this page to avoid collisions
+    page_output_dir = os.path.join(PROCESSED_DIR, f"{job_id}_page_{i}_out")
     try:
-        # Update status: Loading Model
-        update_job(job_id, status="processing", progress=0, message="Loading AI Model...")
+        # Convert ONLY the current page
+        images = convert_from_path(file_path, first_page=i, last_page=i, dpi=settings["dpi"])
+        if not images:
+            raise ValueError("Page could not be rendered")
+        image = images[0].convert("RGB") # Ensure RGB
+        
+        # Save temp image for model.infer (requires file path)
+        image.save(temp_image_path)
+        os.makedirs(page_output_dir, exist_ok=True)
+
+        if ISOLATE_INFERENCE:
+            return get_supervisor().infer(job_id, i, temp_image_path, page_output_dir, prompt, settings,
+                                          timeout=PAGE_TIMEOUT_SECONDS, max_tokens=MAX_TOKENS,
+                                          model_ref=model_ref)
 
-        # Load model if not loaded
-        if model is None:
-             load_model()
+        model, tokenizer = get_registry().get(model_ref)
 
-        # Update status: Counting pages
-        update_job(job_id, status="processing", progress=5, message="Analyzing PDF...")
+        # Stream tokens to SSE subscribers (through infer() or model.generate()); the streamer
+        # also enforces MAX_TOKENS, so it is attached even with streaming disabled
+        streamer = PageTextStreamer(tokenizer, job_id, i, max_tokens=MAX_TOKENS,
+                                    broker=broker if STREAMING_ENABLED else None)
+        return run_infer(model, tokenizer, temp_image_path, page_output_dir, prompt, settings, streamer)
+    finally:
+        # Cleanup temp file and dir
+        if os.path.exists(temp_image_path):
+            try:
+                os.remove(temp_image_path)
+            except: pass
+        if os.path.exists(page_output_dir):
+            import shutil
+            shutil.rmtree(page_output_dir, ignore_errors=True)
 
-        # 1. Get Page Count
+def ocr_page(job_id: str, file_path: str, page_number: int, custom_prompt: str = None, model_ref: str = None):
+    """
+    Render and OCR a single page with `model_ref` ('name@precision', default model if None),
+    retrying with degraded settings on failure or timeout.
+    Returns (text, failed); errors end up in the page text, never raised.
+    """
+    i = page_number
+    # Prepare prompt (Official Format)
+    prompt = custom_prompt if custom_prompt else DEFAULT_PROMPT
+
+    error = None
+    for attempt, settings in enumerate(PAGE_ATTEMPTS, start=1):
         try:
-            info = pdf2image.pdfinfo_from_path(file_path)
-            total_pages = info["Pages"]
+            text = _ocr_page_attempt(job_id, file_path, i, prompt, settings, model_ref)
+            # DEBUG LOGGING
+            logger.info(f"--- Raw Model Output Page {i} ---\n{text}\n-------------------------------")
+            return text, False
         except Exception as e:
-             logger.warning(f"Could not get page count via pdfinfo: {e}, falling back to full read")
-             total_pages = 1 
-        
+            error = e
+            kind = "timed out" if isinstance(e, InferenceTimeout) else "failed"
+            logger.error(f"Error on page {i}, attempt {attempt}/{len(PAGE_ATTEMPTS)} {kind} ({settings}): {e}")
+            broker.clear(job_id)
+
+    return f"[Error processing page {i}: {str(error)}]", True
+
+def save_page(job_id, page_number, text, pages_done, pages_total, failed=False):
+    """Commit a finished (or failed) page and update progress over the selected pages."""
+    # SAVE PAGE RESULT DIRECTLY TO DB (No RAM accumulation)
+    # The page is only committed once complete; drop the partial snapshot
+    save_page_result(job_id, page_number, text, status="failed" if failed else "ok")
+    broker.clear(job_id)
+    if failed:
+        increment_failed_pages(job_id)
+
+    progress = int((pages_done / pages_total) * 100)
+    update_job(job_id, status="processing", progress=progress, current_page=page_number)
+    webhooks.notify(job_id, webhooks.PAGE_COMPLETED, page_number=page_number, progress=progress,
+                    failed=failed)
+
+def finish_job(job_id, total_pages):
+    # Mark Job as Completed (Pass empty list as data is in streaming table)
+    save_result(job_id, [])
+    update_job(job_id, status="completed", progress=100, total_pages=total_pages,
+               completed_at=now_timestamp())
+    broker.clear(job_id)
+    webhooks.notify(job_id, webhooks.JOB_COMPLETED)
+
+def fail_job(job_id, error):
+    logger.error(f"Error processing job {job_id}: {error}")
+    # Atomic error write
+    update_job(job_id, status="error", error=str(error), message="Processing Failed",
+               completed_at=now_timestamp())
+    broker.clear(job_id)
+    webhooks.notify(job_id, webhooks.JOB_FAILED, error=str(error))
+
+def process_pdf_background(job_id: str, file_path: str, custom_prompt: str = None, pages=None,
+                           model_ref: str = None):
+    """
+    Process a whole PDF sequentially in the calling thread.
+    `pages` restricts processing to a list of page numbers (default: all pages).
+    Uploads go through the page-granular scheduler instead (backend.services.scheduler).
+    """
+    try:
+        total_pages = count_pages(file_path)
+        pages = pages or list(range(1, total_pages + 1))
+
         # Check for cancellation before loop
-        job_info = get_job(job_id)
-        if not job_info or job_info.get('cancelled') == 1 or job_info.get('status') == 'cancelled':
-            logger.info(f"Job {job_id} stopped (Cancelled or Deleted).")
-            if job_info:
-                update_job(job_id, status="cancelled", message="Cancelled by user")
-            # Cleanup source file if needed
+        if is_job_cancelled(job_id):
+            mark_cancelled(job_id)
             return
 
-        update_job(job_id, status="processing", progress=5, current_page=0, total_pages=total_pages)
-        
-        # 2. Iterate and OCR
-        for i in range(1, total_pages + 1):
-            # Check for cancellation or deletion inside loop
-            job_info = get_job(job_id)
-            logger.info(f"Checking cancellation for {job_id}: found={bool(job_info)}")
-            
+        start_job(job_id, total_pages)
+
+        for done, i in enumerate(pages, start=1):
             # Stop if job is deleted (None) or cancelled
-            if not job_info or job_info.get('cancelled') == 1 or job_info.get('status') == 'cancelled':
-                logger.info(f"Job {job_id} stopped (Cancelled or Deleted).")
-                if job_info: # Only update if it still exists
-                    update_job(job_id, status="cancelled", message="Cancelled by user")
+            if is_job_cancelled(job_id):
+                mark_cancelled(job_id)
                 return
 
-            temp_image_path = None
-            text = ""
-            try:
-                # Convert ONLY the current page
-                images = convert_from_path(file_path, first_page=i, last_page=i, dpi=300)
-                if not images:
-                    break
-                image = images[0].convert("RGB") # Ensure RGB
-                
-                # Save temp image for model.infer (requires file path)
-                temp_image_path = os.path.join(PROCESSED_DIR, f"{job_id}_temp_page_{i}.png")
-                image.save(temp_image_path)
-
-                # Prepare prompt (Official Format)
-                default_prompt = "<image>\n<|grounding|>Convert the document to markdown."
-                prompt = custom_prompt if custom_prompt else default_prompt
-                
-                # Create unique output directory for this page to avoid collisions
-                page_output_dir = os.path.join(PROCESSED_DIR, f"{job_id}_page_{i}_out")
-                os.makedirs(page_output_dir, exist_ok=True)
-
-                # Inference using native .infer() method from DeepSeek-OCR
-                # Note: The README suggests model.infer(...)
-                text_result = model.infer(
-                    tokenizer,
-                    prompt=prompt,
-                    image_file=temp_image_path,
-                    output_path=page_output_dir,  # Save to unique dir
-                    base_size=1024,
-                    image_size=768,  # Official example uses 768
-                    crop_mode=True,
-                    save_results=True, 
-                    test_compress=False
-                )
-                
-                # If model.infer returns None (it might just save a file), we need to read that file.
-                if text_result is None:
-                     # DeepSeek-OCR saves as 'result.mmd' (Markdown) or 'result_with_boxes.jpg'
-                     
-                     root_mmd = os.path.join(page_output_dir, "result.mmd")
-                     sub_mmd = os.path.join(page_output_dir, "to_markdown", "result.mmd")
-
-                     if os.path.exists(root_mmd):
-                         with open(root_mmd, 'r') as f: text = f.read()
-                     elif os.path.exists(sub_mmd):
-                         with open(sub_mmd, 'r') as f: text = f.read()
-                     else:
-                         files = os.listdir(page_output_dir)
-                         md_files = [f for f in files if f.endswith('.md') or f.endswith('.mmd')]
-                         if md_files:
-                             with open(os.path.join(page_output_dir, md_files[0]), 'r') as f: text = f.read()
-                         else:
-                             text = "[Error: Could not find result.mmd in output]"
-                else:
-                    text = text_result
-
-                # DEBUG LOGGING
-                logger.info(f"--- Raw Model Output Page {i} ---\n{text}\n-------------------------------")
-                
-            except Exception as e:
-                logger.error(f"Error on page {i}: {e}")
-                text = f"[Error processing page {i}: {str(e)}]"
-            
-            # Cleanup temp file and dir
-            if temp_image_path and os.path.exists(temp_image_path):
-                try:
-                    os.remove(temp_image_path)
-                except: pass
-                
-            if 'page_output_dir' in locals() and os.path.exists(page_output_dir):
-                import shutil
-                shutil.rmtree(page_output_dir, ignore_errors=True)
-
-            # SAVE PAGE RESULT DIRECTLY TO DB (No RAM accumulation)
-            save_page_result(job_id, i, text)
-            
-            # Update status
-            progress = int((i / total_pages) * 100)
-            update_job(job_id, status="processing", progress=progress, current_page=i)
-
-        # 3. Mark Job as Completed (Pass empty list as data is in streaming table)
-        save_result(job_id, [])
-            
-        # Update status: Completed
-        update_job(job_id, status="completed", progress=100, total_pages=total_pages)
+            text, failed = ocr_page(job_id, file_path, i, custom_prompt, model_ref)
+            save_page(job_id, i, text, done, len(pages), failed=failed)
+
+        finish_job(job_id, total_pages)
 
     except Exception as e:
-        logger.error(f"Error processing job {job_id}: {e}")
-        # Atomic error write
-        update_job(job_id, status="error", error=str(e), message="Processing Failed")
+        fail_job(job_id, e)
+
+def recover_jobs(scheduler, upload_dir):
+    """
+    Re-queue jobs a previous run left queued or processing (the scheduler queue lives in memory),
+    skipping pages already committed. Jobs whose upload is gone are failed, and cancellations
+    no worker acknowledged are finalized. Returns the number of jobs re-queued.
+    """
+    from backend.services.scheduler import parse_page_range, resolve_priority
+
+    for job in get_pending_cancellations():
+        mark_cancelled(job["id"])
+
+    requeued = 0
+    for job in get_unfinished_jobs():
+        job_id = job["id"]
+        file_path = os.path.join(upload_dir, f"{job_id}_{job['original_filename']}")
+        if not os.path.exists(file_path):
+            fail_job(job_id, "Interrupted by a server restart and the upload is no longer available")
+            continue
+        try:
+            total_pages = job["total_pages"] or count_pages(file_path)
+            done = get_job_page_numbers(job_id)
+            pages = [p for p in parse_page_range(job["page_range"], total_pages) if p not in done]
+            if not pages:
+                finish_job(job_id, total_pages)
+                continue
+            update_job(job_id, status="queued", message="Re-queued after restart")
+            priority = resolve_priority(job["priority"], len(pages))
+            scheduler.submit(job_id, file_path, job["used_prompt"], pages, priority, total_pages,
+                             file_bytes=os.path.getsize(file_path), model=job["model"],
+                             pages_done=len(done), enforce_limits=False)
+            requeued += 1
+        except Exception as e:
+            fail_job(job_id, e)
+    if requeued:
+        logger.info(f"Re-queued {requeued} job(s) interrupted by the last shutdown")
+    return requeued
 
 def run_deepseek_ocr(image):
     # This function is now folded into the main loop or can be separated if needed for cleaner code
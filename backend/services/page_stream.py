@@ -0,0 +1,127 @@
+import threading
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class PartialPageBroker:
+    """
+    In-memory store of the page currently being generated for each job.
+    Inference threads append text deltas here; SSE handlers read the joined text.
+    Only the page in flight is kept per job (no token history in RAM).
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pages = {}  # job_id -> {"page": int, "chunks": [str], "version": int}
+
+    def append(self, job_id, page_number, delta):
+        """Add newly generated text; a different page number starts a fresh snapshot."""
+        with self._lock:
+            entry = self._pages.get(job_id)
+            if entry is None or entry["page"] != page_number:
+                version = entry["version"] + 1 if entry else 1
+                self._pages[job_id] = {"page": page_number, "chunks": [delta], "version": version}
+            else:
+                entry["chunks"].append(delta)
+                entry["version"] += 1
+
+    def get(self, job_id):
+        """Return the current partial page for a job as {page, text, version}, or None."""
+        with self._lock:
+            entry = self._pages.get(job_id)
+            if entry is None:
+                return None
+            return {"page": entry["page"], "text": "".join(entry["chunks"]), "version": entry["version"]}
+
+    def clear(self, job_id):
+        with self._lock:
+            self._pages.pop(job_id, None)
+
+
+# Shared broker for the whole process (background threads + API handlers)
+broker = PartialPageBroker()
+
+
+class TokenLimitExceeded(Exception):
+    """Raised from the streamer to abort a generation that ran past max_tokens."""
+
+
+class PageTextStreamer:
+    """
+    Token streamer for `generate(..., streamer=...)`.
+    Follows the transformers BaseStreamer protocol (put/end) without importing it.
+    Like transformers' TextStreamer, only the tokens since the last newline are
+    re-decoded, and just the new text is appended to the broker, so a page costs
+    linear rather than quadratic decode time.
+    With `max_tokens`, raising from put() is also how runaway generations are cut off:
+    the exception propagates out of the generate loop. With `broker=None` the streamer
+    only counts tokens for that limit and never decodes.
+    """
+
+    def __init__(self, tokenizer, job_id, page_number, skip_prompt=True,
+                 publish_every=1, broker=broker, max_tokens=None):
+        self.tokenizer = tokenizer
+        self.job_id = job_id
+        self.page_number = page_number
+        self.skip_prompt = skip_prompt
+        self.publish_every = max(1, publish_every)
+        self.broker = broker
+        self.max_tokens = max_tokens
+        self.token_count = 0
+        self._chunks = []
+        self._token_cache = []  # tokens of the current line
+        self._printed_len = 0   # characters of the current line already emitted
+        self._next_tokens_are_prompt = True
+        self._pending = 0
+
+    @property
+    def text(self):
+        return "".join(self._chunks)
+
+    def put(self, value):
+        # generate() sends the prompt first, then one token batch per step
+        if self.skip_prompt and self._next_tokens_are_prompt:
+            self._next_tokens_are_prompt = False
+            return
+        self._next_tokens_are_prompt = False
+
+        if hasattr(value, "tolist"):
+            value = value.tolist()
+        if isinstance(value, int):
+            value = [value]
+        # Flatten a [batch, tokens] shape (batch size is always 1 here)
+        if value and isinstance(value[0], list):
+            value = value[0]
+
+        self.token_count += len(value)
+        if self.broker is not None:
+            self._token_cache.extend(value)
+            self._pending += len(value)
+            if self._pending >= self.publish_every:
+                self._flush()
+
+        if self.max_tokens and self.token_count > self.max_tokens:
+            raise TokenLimitExceeded(f"Generation exceeded {self.max_tokens} tokens")
+
+    def end(self):
+        if self.broker is not None:
+            self._flush(final=True)
+
+    def _flush(self, final=False):
+        self._pending = 0
+        if not self._token_cache:
+            return
+        line = self.tokenizer.decode(self._token_cache, skip_special_tokens=True)
+        if final or line.endswith("\n"):
+            delta = line[self._printed_len:]
+            self._token_cache = []
+            self._printed_len = 0
+        elif line.endswith("\ufffd"):
+            return  # Incomplete multi-byte character; wait for the next token
+        else:
+            delta = line[self._printed_len:]
+            self._printed_len = len(line)
+        if delta:
+            self._chunks.append(delta)
+            self.broker.append(self.job_id, self.page_number, delta)
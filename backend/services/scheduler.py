@@ -0,0 +1,387 @@
+import os
+import time
+import logging
+import threading
+import itertools
+from collections import deque
+from datetime import datetime, timedelta
+
+logger = logging.getLogger(__name__)
+
+# Priority classes, highest first. Interactive jobs preempt bulk jobs between pages.
+INTERACTIVE = "interactive"
+BULK = "bulk"
+PRIORITY_CLASSES = (INTERACTIVE, BULK)
+
+# Jobs without an explicit priority are interactive if they are this small
+INTERACTIVE_MAX_PAGES = int(os.getenv("OCR_INTERACTIVE_MAX_PAGES", "10"))
+# How many wait samples per class are kept for the stats endpoint
+WAIT_SAMPLES = 200
+# Rolling window (in pages) for the throughput measurement
+RATE_SAMPLES = 50
+# Throughput assumed before any page has been measured
+DEFAULT_PAGES_PER_SECOND = float(os.getenv("OCR_DEFAULT_PAGES_PER_SEC", "0.2"))
+# A worker keeps serving jobs for the model it already has loaded, but never makes
+# the oldest job in the class wait longer than this for a model switch
+MODEL_AFFINITY_MAX_WAIT = float(os.getenv("OCR_MODEL_AFFINITY_MAX_WAIT", "300"))
+
+
+class AdmissionLimits:
+    """Queue limits checked on every submit. 0 disables a limit."""
+
+    def __init__(self, max_queued_pages=0, max_queued_bytes=0, max_jobs_per_client=0):
+        self.max_queued_pages = max_queued_pages
+        self.max_queued_bytes = max_queued_bytes
+        self.max_jobs_per_client = max_jobs_per_client
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            max_queued_pages=int(os.getenv("OCR_MAX_QUEUED_PAGES", "5000")),
+            max_queued_bytes=int(os.getenv("OCR_MAX_QUEUED_BYTES", str(2 * 1024 ** 3))),
+            max_jobs_per_client=int(os.getenv("OCR_MAX_JOBS_PER_CLIENT", "5")),
+        )
+
+
+class AdmissionRejected(Exception):
+    """Raised by submit() when a limit is hit; retry_after is in seconds."""
+
+    def __init__(self, reason, retry_after):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class JobTooLarge(Exception):
+    """Raised by submit() for a job that exceeds a queue limit on its own; retrying cannot help."""
+
+    def __init__(self, reason):
+        super().__init__(reason)
+        self.reason = reason
+
+
+def parse_page_range(spec, total_pages):
+    """
+    Parse a page selection like "1-3,7,10-" into a sorted list of page numbers.
+    Open ranges ("10-") run to the last page. Raises ValueError on invalid input.
+    """
+    if not spec or not spec.strip():
+        return list(range(1, total_pages + 1))
+
+    pages = set()
+    for part in spec.split(","):
+        part = part.strip()
+        if not part:
+            continue
+        if "-" in part:
+            start, end = part.split("-", 1)
+            start = int(start) if start.strip() else 1
+            end = int(end) if end.strip() else total_pages
+        else:
+            start = end = int(part)
+        if start < 1 or end < start:
+            raise ValueError(f"Invalid page range '{part}'")
+        if start > total_pages:
+            raise ValueError(f"Page {start} is beyond the last page ({total_pages})")
+        pages.update(range(start, min(end, total_pages) + 1))
+
+    if not pages:
+        raise ValueError("Page range selects no pages")
+    return sorted(pages)
+
+
+def resolve_priority(priority, page_count):
+    """Validate an explicit priority class or pick one from the job size."""
+    if priority:
+        if priority not in PRIORITY_CLASSES:
+            raise ValueError(f"Unknown priority '{priority}', expected one of {PRIORITY_CLASSES}")
+        return priority
+    return INTERACTIVE if page_count <= INTERACTIVE_MAX_PAGES else BULK
+
+
+class ScheduledJob:
+    """A queued job: the pages still to OCR and the class it is scheduled in."""
+
+    def __init__(self, seq, job_id, file_path, prompt, pages, priority, total_pages, preview_pages=0,
+                 client_id=None, file_bytes=0, model=None, pages_done=0):
+        self.seq = seq
+        self.job_id = job_id
+        self.file_path = file_path
+        self.prompt = prompt
+        self.pages = deque(pages)
+        # pages_done > 0 when a job is resumed; progress stays over the whole selection
+        self.pages_total = len(pages) + pages_done
+        self.pages_done = pages_done
+        self.priority = priority
+        self.total_pages = total_pages
+        # The first `preview_pages` pages run in the interactive lane regardless of priority
+        self.preview_remaining = preview_pages
+        self.client_id = client_id
+        self.file_bytes = file_bytes
+        self.model = model
+        self.enqueued_at = time.monotonic()
+        # When the job last became ready for a worker (aging for model affinity)
+        self.ready_since = self.enqueued_at
+        self.started = False
+        self.running = False
+
+    @property
+    def current_class(self):
+        return INTERACTIVE if self.preview_remaining > 0 else self.priority
+
+
+class JobScheduler:
+    """
+    Page-granular job scheduler.
+    Workers take one page at a time from the highest-priority job (FIFO within a class),
+    so an interactive upload only waits for the page currently in flight; the bulk job
+    it preempted resumes afterwards from where it stopped. Within a class, a worker
+    prefers jobs for the model it ran last, to avoid model swaps (bounded by
+    MODEL_AFFINITY_MAX_WAIT).
+
+    `runner` provides the job lifecycle (start_job, ocr_page, save_page, finish_job,
+    fail_job, is_job_cancelled, mark_cancelled); it defaults to ocr_service.
+    """
+
+    def __init__(self, runner=None, num_workers=1, limits=None):
+        self._runner = runner
+        self.num_workers = num_workers
+        self.limits = limits or AdmissionLimits()
+        self._cond = threading.Condition()
+        self._jobs = {}  # job_id -> ScheduledJob
+        self._seq = itertools.count()
+        self._threads = []
+        self._waits = {c: deque(maxlen=WAIT_SAMPLES) for c in PRIORITY_CLASSES}
+        self._page_durations = deque(maxlen=RATE_SAMPLES)
+
+    @property
+    def runner(self):
+        if self._runner is None:
+            from backend.services import ocr_service
+            self._runner = ocr_service
+        return self._runner
+
+    def submit(self, job_id, file_path, prompt, pages, priority, total_pages, preview_pages=0,
+               client_id=None, file_bytes=0, model=None, pages_done=0, enforce_limits=True):
+        """
+        Queue a job after checking admission limits.
+        Returns (ScheduledJob, estimate); raises AdmissionRejected if the queue is full
+        and JobTooLarge if the job alone is over a limit.
+        `pages_done` and `enforce_limits=False` are for jobs resumed after a restart.
+        """
+        with self._cond:
+            if enforce_limits:
+                self._check_admission(client_id, len(pages), file_bytes)
+            job = ScheduledJob(next(self._seq), job_id, file_path, prompt, pages, priority,
+                               total_pages, preview_pages=preview_pages,
+                               client_id=client_id, file_bytes=file_bytes, model=model,
+                               pages_done=pages_done)
+            self._jobs[job_id] = job
+            estimate = self._estimate(job)
+            self._ensure_workers()
+            self._cond.notify_all()
+        logger.info(f"Scheduled job {job_id}: {len(pages)} pages, class={job.current_class}, model={model}")
+        return job, estimate
+
+    def discard(self, job_id):
+        """
+        Drop a job that is waiting for a worker. Returns False if it is not queued
+        or a page is in flight (the worker then stops it at the next page boundary).
+        """
+        with self._cond:
+            job = self._jobs.get(job_id)
+            if job is None or job.running:
+                return False
+            del self._jobs[job_id]
+            return True
+
+    def check_admission(self, client_id, pages=0, file_bytes=0):
+        """Raise AdmissionRejected (or JobTooLarge) if a job of this size would not be accepted now."""
+        with self._cond:
+            self._check_admission(client_id, pages, file_bytes)
+
+    def estimate(self, job_id):
+        """Current start/finish estimate for a queued job, or None if it is not queued."""
+        with self._cond:
+            job = self._jobs.get(job_id)
+            return self._estimate(job) if job else None
+
+    def pages_per_second(self):
+        """Rolling throughput of all workers, from the last RATE_SAMPLES page durations."""
+        with self._cond:
+            return self._pages_per_second()
+
+    def stats(self):
+        """Queue depth and observed wait time (enqueue -> first page) per class."""
+        with self._cond:
+            result = {}
+            for cls in PRIORITY_CLASSES:
+                queued = [j for j in self._jobs.values() if j.current_class == cls]
+                waits = sorted(self._waits[cls])
+                result[cls] = {
+                    "jobs": len(queued),
+                    "pages": sum(len(j.pages) for j in queued),
+                    "waits_recorded": len(waits),
+                    "avg_wait_seconds": round(sum(waits) / len(waits), 3) if waits else None,
+                    "p95_wait_seconds": round(waits[int(0.95 * (len(waits) - 1))], 3) if waits else None,
+                    "max_wait_seconds": round(waits[-1], 3) if waits else None,
+                }
+            result["pages_per_second"] = round(self._pages_per_second(), 4)
+            result["queued_bytes"] = sum(j.file_bytes for j in self._jobs.values())
+            return result
+
+    # The helpers below are called with the lock held
+
+    def _pages_per_second(self):
+        if not self._page_durations:
+            return DEFAULT_PAGES_PER_SECOND
+        mean = sum(self._page_durations) / len(self._page_durations)
+        return self.num_workers / mean if mean > 0 else DEFAULT_PAGES_PER_SECOND
+
+    def _check_admission(self, client_id, pages, file_bytes):
+        limits = self.limits
+        if limits.max_queued_pages and pages > limits.max_queued_pages:
+            raise JobTooLarge(f"Job has {pages} pages, the queue holds at most {limits.max_queued_pages}")
+        if limits.max_queued_bytes and file_bytes > limits.max_queued_bytes:
+            raise JobTooLarge(f"File is {file_bytes} bytes, the queue holds at most {limits.max_queued_bytes}")
+
+        rate = self._pages_per_second()
+        queued_pages = sum(len(j.pages) for j in self._jobs.values())
+
+        if limits.max_queued_pages and queued_pages + pages > limits.max_queued_pages:
+            excess = queued_pages + pages - limits.max_queued_pages
+            raise AdmissionRejected(
+                f"Queue is full ({queued_pages} pages queued)", self._retry_after(excess / rate))
+
+        queued_bytes = sum(j.file_bytes for j in self._jobs.values())
+        if limits.max_queued_bytes and queued_bytes + file_bytes > limits.max_queued_bytes:
+            # Assume bytes drain at the same pace as pages
+            excess_fraction = (queued_bytes + file_bytes - limits.max_queued_bytes) / max(queued_bytes, 1)
+            raise AdmissionRejected(
+                f"Queue is full ({queued_bytes} bytes queued)",
+                self._retry_after(excess_fraction * queued_pages / rate))
+
+        if limits.max_jobs_per_client and client_id is not None:
+            client_jobs = [j for j in self._jobs.values() if j.client_id == client_id]
+            if len(client_jobs) >= limits.max_jobs_per_client:
+                shortest = min(len(j.pages) for j in client_jobs)
+                raise AdmissionRejected(
+                    f"Too many concurrent jobs for this client ({len(client_jobs)})",
+                    self._retry_after(shortest / rate))
+
+    @staticmethod
+    def _retry_after(seconds):
+        return max(1, int(seconds + 0.999))
+
+    def _estimate(self, job):
+        """Estimate start/finish from the pages scheduled ahead of `job` and the rolling rate."""
+        rate = self._pages_per_second()
+        rank = PRIORITY_CLASSES.index(job.current_class)
+        ahead = 0
+        for other in self._jobs.values():
+            if other is job:
+                continue
+            if other.running:
+                ahead += 1  # The page in flight is never preempted
+            other_rank = PRIORITY_CLASSES.index(other.current_class)
+            if other_rank < rank or (other_rank == rank and other.seq < job.seq):
+                ahead += len(other.pages) - (1 if other.running else 0)
+        start_seconds = ahead / rate
+        finish_seconds = start_seconds + len(job.pages) / rate
+        now = datetime.utcnow()
+        return {
+            "pages_per_second": round(rate, 4),
+            "pages_ahead": ahead,
+            "estimated_start_seconds": round(start_seconds, 1),
+            "estimated_finish_seconds": round(finish_seconds, 1),
+            "estimated_start": (now + timedelta(seconds=start_seconds)).isoformat() + "Z",
+            "estimated_finish": (now + timedelta(seconds=finish_seconds)).isoformat() + "Z",
+        }
+
+    def _ensure_workers(self):
+        # Called with the lock held; workers are started lazily on first submit
+        while len(self._threads) < self.num_workers:
+            t = threading.Thread(target=self._worker_loop, name=f"ocr-worker-{len(self._threads)}", daemon=True)
+            self._threads.append(t)
+            t.start()
+
+    def _next_job(self, current_model=None):
+        """Block until a job has a page ready; return it marked as running."""
+        with self._cond:
+            while True:
+                ready = [j for j in self._jobs.values() if j.pages and not j.running]
+                if ready:
+                    job = self._pick(ready, current_model)
+                    job.running = True
+                    return job
+                self._cond.wait()
+
+    @staticmethod
+    def _pick(ready, current_model):
+        """Highest class first; within it FIFO, except that jobs for `current_model` go first."""
+        rank = min(PRIORITY_CLASSES.index(j.current_class) for j in ready)
+        in_class = sorted((j for j in ready if PRIORITY_CLASSES.index(j.current_class) == rank),
+                          key=lambda j: j.seq)
+        head = in_class[0]
+        if current_model is None or head.model == current_model:
+            return head
+        if time.monotonic() - head.ready_since >= MODEL_AFFINITY_MAX_WAIT:
+            return head
+        return next((j for j in in_class if j.model == current_model), head)
+
+    def _release(self, job, drop=False):
+        with self._cond:
+            job.running = False
+            job.ready_since = time.monotonic()
+            if drop or not job.pages:
+                self._jobs.pop(job.job_id, None)
+            self._cond.notify_all()
+
+    def _worker_loop(self):
+        current_model = None
+        while True:
+            job = self._next_job(current_model)
+            current_model = job.model
+            try:
+                finished = self._run_one_page(job)
+            except Exception as e:
+                self.runner.fail_job(job.job_id, e)
+                finished = True
+            self._release(job, drop=finished)
+
+    def _run_one_page(self, job):
+        """Process the next page of `job`. Returns True when the job left the queue."""
+        runner = self.runner
+
+        # Stop if job is deleted (None) or cancelled
+        if runner.is_job_cancelled(job.job_id):
+            runner.mark_cancelled(job.job_id)
+            return True
+
+        if not job.started:
+            wait = time.monotonic() - job.enqueued_at
+            with self._cond:
+                self._waits[job.current_class].append(wait)
+            job.started = True
+            runner.start_job(job.job_id, job.total_pages)
+
+        page_number = job.pages[0]
+        page_started = time.monotonic()
+        text, failed = runner.ocr_page(job.job_id, job.file_path, page_number, job.prompt,
+                                       model_ref=job.model)
+        with self._cond:
+            self._page_durations.append(time.monotonic() - page_started)
+            job.pages.popleft()
+            job.pages_done += 1
+            if job.preview_remaining > 0:
+                job.preview_remaining -= 1
+        runner.save_page(job.job_id, page_number, text, job.pages_done, job.pages_total, failed=failed)
+
+        if not job.pages:
+            runner.finish_job(job.job_id, job.total_pages)
+            return True
+        return False
+
+
+# Shared scheduler; one worker per GPU model instance
+scheduler = JobScheduler(num_workers=int(os.getenv("OCR_WORKERS", "1")), limits=AdmissionLimits.from_env())
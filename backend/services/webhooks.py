@@ -0,0 +1,329 @@
+import os
+import hmac
+import json
+import time
+import socket
+import hashlib
+import logging
+import threading
+import ipaddress
+import urllib.parse
+import urllib.request
+from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor
+
+from backend.database import (
+    get_job, enqueue_webhook, claim_due_webhooks, update_webhook, requeue_sending_webhooks,
+    get_webhook_counts, prune_webhooks, now_timestamp
+)
+
+logger = logging.getLogger(__name__)
+
+JOB_COMPLETED = "job.completed"
+JOB_FAILED = "job.failed"
+JOB_CANCELLED = "job.cancelled"
+PAGE_COMPLETED = "page.completed"
+EVENTS = (JOB_COMPLETED, JOB_FAILED, JOB_CANCELLED, PAGE_COMPLETED)
+# Per-page callbacks are opt-in
+DEFAULT_EVENTS = (JOB_COMPLETED, JOB_FAILED, JOB_CANCELLED)
+
+# Global callback, applied to every job in addition to any per-upload URL
+GLOBAL_URL = os.getenv("WEBHOOK_URL")
+GLOBAL_EVENTS = os.getenv("WEBHOOK_EVENTS", ",".join(DEFAULT_EVENTS))
+SECRET = os.getenv("WEBHOOK_SECRET", "")
+
+CONCURRENCY = int(os.getenv("WEBHOOK_CONCURRENCY", "4"))
+MAX_ATTEMPTS = int(os.getenv("WEBHOOK_MAX_ATTEMPTS", "8"))
+BACKOFF_BASE_SECONDS = float(os.getenv("WEBHOOK_BACKOFF_BASE", "2"))
+BACKOFF_MAX_SECONDS = float(os.getenv("WEBHOOK_BACKOFF_MAX", "600"))
+TIMEOUT_SECONDS = float(os.getenv("WEBHOOK_TIMEOUT", "10"))
+POLL_SECONDS = 1.0
+
+# Per-upload callback hosts. Uploaders choose the URL, so by default it may not resolve to
+# loopback, private, link-local (cloud metadata) or other reserved addresses.
+# WEBHOOK_ALLOWED_HOSTS: comma-separated hosts; ".example.com" also matches subdomains.
+ALLOWED_HOSTS = [h.strip().lower() for h in os.getenv("WEBHOOK_ALLOWED_HOSTS", "").split(",") if h.strip()]
+ALLOW_PRIVATE_HOSTS = os.getenv("WEBHOOK_ALLOW_PRIVATE_HOSTS", "0") == "1"
+
+# Delivered and dead outbox rows are deleted after this long (0 keeps them forever)
+RETENTION_HOURS = float(os.getenv("WEBHOOK_RETENTION_HOURS", "168"))
+PRUNE_INTERVAL_SECONDS = 3600
+
+
+class WebhookBlocked(ValueError):
+    """The callback URL points at a host the policy does not allow."""
+
+
+def parse_events(events):
+    """Parse a comma-separated event list. Raises ValueError on unknown events."""
+    if not events:
+        return list(DEFAULT_EVENTS)
+    parsed = [e.strip() for e in events.split(",") if e.strip()]
+    unknown = [e for e in parsed if e not in EVENTS]
+    if unknown:
+        raise ValueError(f"Unknown webhook events {unknown}, expected any of {list(EVENTS)}")
+    return parsed
+
+
+def _host_allowed(host):
+    return any(host == allowed or (allowed.startswith(".") and host.endswith(allowed))
+               for allowed in ALLOWED_HOSTS)
+
+
+def check_destination(url):
+    """
+    Apply the callback host policy; raises WebhookBlocked.
+    Resolves the host, so call it off the event loop. It runs again before every delivery,
+    which catches DNS records changed after the upload was accepted.
+    """
+    host = (urllib.parse.urlsplit(url).hostname or "").lower()
+    if not host:
+        raise WebhookBlocked("webhook_url has no host")
+    if ALLOWED_HOSTS and not _host_allowed(host):
+        raise WebhookBlocked(f"Webhook host '{host}' is not in WEBHOOK_ALLOWED_HOSTS")
+    if ALLOW_PRIVATE_HOSTS:
+        return
+    try:
+        addresses = {info[4][0] for info in socket.getaddrinfo(host, None)}
+    except socket.gaierror:
+        raise WebhookBlocked(f"Webhook host '{host}' does not resolve")
+    for address in addresses:
+        ip = ipaddress.ip_address(address.split("%")[0])
+        if not ip.is_global or ip.is_multicast:
+            raise WebhookBlocked(f"Webhook host '{host}' resolves to a non-public address ({ip})")
+
+
+def validate_url(url):
+    if not url.startswith(("http://", "https://")):
+        raise ValueError("webhook_url must be an http(s) URL")
+    check_destination(url)
+    return url
+
+
+class _NoRedirect(urllib.request.HTTPRedirectHandler):
+    """A redirect would bypass the host policy; treat it as a failed delivery."""
+
+    def redirect_request(self, req, fp, code, msg, headers, newurl):
+        return None
+
+
+_opener = urllib.request.build_opener(_NoRedirect)
+
+
+def sign(secret, timestamp, body):
+    """HMAC-SHA256 over '<timestamp>.<body>', hex encoded."""
+    message = f"{timestamp}.".encode("utf-8") + body
+    return hmac.new(secret.encode("utf-8"), message, hashlib.sha256).hexdigest()
+
+
+def backoff_seconds(attempts, base=None, cap=None):
+    """Delay before retry number `attempts` (1-based): base * 2^(attempts-1), capped."""
+    base = BACKOFF_BASE_SECONDS if base is None else base
+    cap = BACKOFF_MAX_SECONDS if cap is None else cap
+    return min(cap, base * 2 ** (attempts - 1))
+
+
+def notify(job_id, event, **data):
+    """
+    Queue `event` for every callback registered for the job (per-upload and global).
+    Only writes to the outbox; delivery happens on the dispatcher thread.
+    Never raises, so a webhook problem cannot fail OCR processing.
+    """
+    try:
+        job = get_job(job_id)
+        if not job:
+            return
+
+        targets = []
+        if job.get("webhook_url"):
+            targets.append((job["webhook_url"], parse_events(job.get("webhook_events"))))
+        if GLOBAL_URL:
+            targets.append((GLOBAL_URL, parse_events(GLOBAL_EVENTS)))
+
+        payload = None
+        for url, events in targets:
+            if event not in events:
+                continue
+            if payload is None:
+                payload = json.dumps({
+                    "event": event,
+                    "job_id": job_id,
+                    "status": job.get("status"),
+                    "original_filename": job.get("original_filename"),
+                    "timestamp": now_timestamp(),
+                    **data,
+                })
+            enqueue_webhook(job_id, event, url, payload, time.time())
+
+        if payload is not None:
+            dispatcher.wake()
+    except Exception as e:
+        logger.error(f"Failed to queue webhook {event} for job {job_id}: {e}")
+
+
+class WebhookDispatcher:
+    """
+    Delivers outbox rows with at most `concurrency` requests in flight.
+    Failed deliveries are rescheduled with exponential backoff; after `max_attempts`
+    they are marked 'dead'.
+    """
+
+    def __init__(self, secret=SECRET, concurrency=CONCURRENCY, max_attempts=MAX_ATTEMPTS,
+                 backoff_base=BACKOFF_BASE_SECONDS, backoff_max=BACKOFF_MAX_SECONDS,
+                 timeout=TIMEOUT_SECONDS, poll_seconds=POLL_SECONDS):
+        self.secret = secret
+        self.concurrency = concurrency
+        self.max_attempts = max_attempts
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.timeout = timeout
+        self.poll_seconds = poll_seconds
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+        self._executor = None
+        self._in_flight = 0
+        self._next_prune = 0.0
+        self.metrics = {
+            "delivered": 0,
+            "failed_attempts": 0,
+            "retries_scheduled": 0,
+            "dead": 0,
+            "blocked": 0,
+            "pruned": 0,
+            "in_flight": 0,
+            "avg_latency_seconds": None,
+        }
+        self._latency_total = 0.0
+
+    def start(self):
+        if self._thread is not None:
+            return
+        requeue_sending_webhooks()
+        self._stop.clear()
+        self._executor = ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix="webhook")
+        self._thread = threading.Thread(target=self._run, name="webhook-dispatcher", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._wake.set()
+        self._thread.join()
+        self._executor.shutdown(wait=True)
+        self._thread = None
+
+    def wake(self):
+        self._wake.set()
+
+    def snapshot(self):
+        with self._lock:
+            return dict(self.metrics)
+
+    def _run(self):
+        while not self._stop.is_set():
+            self._wake.clear()
+            if RETENTION_HOURS and time.monotonic() >= self._next_prune:
+                self._next_prune = time.monotonic() + PRUNE_INTERVAL_SECONDS
+                self._prune()
+            with self._lock:
+                free = self.concurrency - self._in_flight
+            if free > 0:
+                try:
+                    rows = claim_due_webhooks(time.time(), free)
+                except Exception as e:
+                    logger.error(f"Failed to read webhook outbox: {e}")
+                    rows = []
+                for row in rows:
+                    with self._lock:
+                        self._in_flight += 1
+                        self.metrics["in_flight"] = self._in_flight
+                    self._executor.submit(self._deliver, row)
+            self._wake.wait(self.poll_seconds)
+
+    def _prune(self):
+        cutoff = (datetime.utcnow() - timedelta(hours=RETENTION_HOURS)).strftime("%Y-%m-%d %H:%M:%S")
+        try:
+            deleted = prune_webhooks(cutoff)
+        except Exception as e:
+            logger.error(f"Failed to prune webhook outbox: {e}")
+            return
+        with self._lock:
+            self.metrics["pruned"] += deleted
+
+    def _deliver(self, row):
+        attempts = row["attempts"] + 1
+        started = time.monotonic()
+        try:
+            # The operator-configured global URL is trusted; per-upload URLs are re-checked
+            if row["url"] != GLOBAL_URL:
+                check_destination(row["url"])
+            self._post(row)
+        except WebhookBlocked as e:
+            # Permanent: retrying will not change the policy
+            logger.warning(f"Webhook {row['id']} to {row['url']} blocked: {e}")
+            update_webhook(row["id"], status="dead", attempts=attempts, last_error=str(e))
+            with self._lock:
+                self.metrics["blocked"] += 1
+                self.metrics["dead"] += 1
+        except Exception as e:
+            self._failed(row, attempts, str(e))
+        else:
+            latency = time.monotonic() - started
+            update_webhook(row["id"], status="delivered", attempts=attempts, delivered_at=now_timestamp(),
+                           last_error=None)
+            with self._lock:
+                self.metrics["delivered"] += 1
+                self._latency_total += latency
+                self.metrics["avg_latency_seconds"] = round(self._latency_total / self.metrics["delivered"], 4)
+        finally:
+            with self._lock:
+                self._in_flight -= 1
+                self.metrics["in_flight"] = self._in_flight
+            self._wake.set()
+
+    def _post(self, row):
+        body = row["payload"].encode("utf-8")
+        timestamp = str(int(time.time()))
+        headers = {
+            "Content-Type": "application/json",
+            "User-Agent": "deepseek-ocr-platform-webhooks",
+            "X-OCR-Event": row["event"],
+            "X-OCR-Delivery": str(row["id"]),
+            "X-OCR-Timestamp": timestamp,
+        }
+        if self.secret:
+            headers["X-OCR-Signature"] = "sha256=" + sign(self.secret, timestamp, body)
+
+        request = urllib.request.Request(row["url"], data=body, headers=headers, method="POST")
+        # Raises HTTPError for non-2xx answers (redirects included, see _NoRedirect)
+        with _opener.open(request, timeout=self.timeout) as response:
+            response.read()
+
+    def _failed(self, row, attempts, error):
+        with self._lock:
+            self.metrics["failed_attempts"] += 1
+        if attempts >= self.max_attempts:
+            logger.warning(f"Webhook {row['id']} to {row['url']} dead after {attempts} attempts: {error}")
+            update_webhook(row["id"], status="dead", attempts=attempts, last_error=error)
+            with self._lock:
+                self.metrics["dead"] += 1
+            return
+
+        delay = backoff_seconds(attempts, self.backoff_base, self.backoff_max)
+        logger.info(f"Webhook {row['id']} attempt {attempts} failed ({error}), retrying in {delay:.1f}s")
+        update_webhook(row["id"], status="pending", attempts=attempts, last_error=error,
+                       next_attempt_at=time.time() + delay)
+        with self._lock:
+            self.metrics["retries_scheduled"] += 1
+
+
+def metrics():
+    """Dispatcher counters plus outbox rows per status."""
+    return {**dispatcher.snapshot(), "outbox": get_webhook_counts()}
+
+
+# Shared dispatcher, started with the app
+dispatcher = WebhookDispatcher()
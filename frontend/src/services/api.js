@@ -8,12 +8,25 @@ const api = axios.create({
 
 export default {
     // Changed upload to accept prompt_id
-    uploadFile(file, promptId = null, onUploadProgress) {
+    // options: { pages: "1-3,7", priority: "interactive" | "bulk", previewPages: N, model: "name@precision" }
+    uploadFile(file, promptId = null, onUploadProgress, options = {}) {
         let formData = new FormData();
         formData.append("file", file);
         if (promptId) {
             formData.append("prompt_id", promptId);
         }
+        if (options.pages) {
+            formData.append("pages", options.pages);
+        }
+        if (options.priority) {
+            formData.append("priority", options.priority);
+        }
+        if (options.previewPages) {
+            formData.append("preview_pages", options.previewPages);
+        }
+        if (options.model) {
+            formData.append("model", options.model);
+        }
 
         return axios.post(`${API_URL}/upload`, formData, {
             headers: {
@@ -34,6 +47,12 @@ export default {
     updatePrompt(id, data) {
         return axios.put(`${API_URL}/prompts/${id}`, data);
     },
+    getModels() {
+        return api.get('/models');
+    },
+    getSchedulerStats() {
+        return api.get('/scheduler/stats');
+    },
     getStatus(jobId) {
         return api.get(`/status/${jobId}`);
     },
@@ -0,0 +1,80 @@
+"""
+Load test: latency of /status while Excel exports run concurrently.
+Requires a running backend and at least one completed job.
+
+    python load_test_status.py [--job-id ID] [--exporters 4] [--pollers 8] [--duration 20]
+"""
+import argparse
+import threading
+import time
+
+import requests
+
+API = "http://localhost:8000/api"
+
+
+def percentile(values, pct):
+    values = sorted(values)
+    if not values:
+        return float("nan")
+    return values[min(len(values) - 1, int(round(pct / 100 * (len(values) - 1))))]
+
+
+def pick_job(job_id):
+    if job_id:
+        return job_id
+    jobs = requests.get(f"{API}/jobs", timeout=10).json()
+    completed = [j for j in jobs if j["status"] == "completed"]
+    if not completed:
+        raise SystemExit("❌ No completed job to export. Process a PDF first or pass --job-id.")
+    return completed[0]["id"]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--job-id")
+    parser.add_argument("--exporters", type=int, default=4)
+    parser.add_argument("--pollers", type=int, default=8)
+    parser.add_argument("--duration", type=float, default=20)
+    args = parser.parse_args()
+
+    job_id = pick_job(args.job_id)
+    stop = threading.Event()
+    latencies = []
+    exports = []
+    lock = threading.Lock()
+
+    def exporter():
+        while not stop.is_set():
+            started = time.perf_counter()
+            requests.get(f"{API}/download/{job_id}/xlsx", timeout=120)
+            with lock:
+                exports.append(time.perf_counter() - started)
+
+    def poller():
+        while not stop.is_set():
+            started = time.perf_counter()
+            requests.get(f"{API}/status/{job_id}", timeout=30)
+            with lock:
+                latencies.append(time.perf_counter() - started)
+
+    threads = [threading.Thread(target=exporter) for _ in range(args.exporters)]
+    threads += [threading.Thread(target=poller) for _ in range(args.pollers)]
+    print(f"Running {args.exporters} exporters + {args.pollers} /status pollers for {args.duration}s on job {job_id}...")
+    for t in threads:
+        t.start()
+    time.sleep(args.duration)
+    stop.set()
+    for t in threads:
+        t.join()
+
+    ms = [v * 1000 for v in latencies]
+    print(f"/status requests: {len(ms)}  exports: {len(exports)}")
+    print(f"/status latency ms  p50={percentile(ms, 50):.1f}  p95={percentile(ms, 95):.1f}  p99={percentile(ms, 99):.1f}  max={max(ms, default=0):.1f}")
+
+    loop = requests.get(f"{API}/health/loop", timeout=10).json()
+    print(f"Event loop: stalls={loop['stalls']} max_lag={loop['max_lag_seconds'] * 1000:.0f}ms")
+
+
+if __name__ == "__main__":
+    main()
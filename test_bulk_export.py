@@ -0,0 +1,107 @@
+import unittest
+import io
+import os
+import json
+import tempfile
+
+from backend import database
+from backend.services import bulk_export
+
+try:
+    import pyarrow
+except ImportError:
+    pyarrow = None
+
+
+class TestBulkExport(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.old_db_path = database.DB_PATH
+        database.DB_PATH = os.path.join(self.tmp.name, "ocr.db")
+        database.init_db()
+
+        database.create_job("done", original_filename="invoice.pdf", used_prompt="Free OCR.")
+        database.create_job("running", original_filename="archive.pdf")
+        database.create_job("later", original_filename="report.pdf")
+        database.save_page_result("done", 1, "page one")
+        database.save_page_result("running", 1, "partial archive")
+        database.save_page_result("done", 2, "page two")
+        database.save_page_result("later", 1, "report")
+        database.save_result("done", [])
+        database.save_result("later", [])
+        database.update_job("running", status="processing")
+
+    def tearDown(self):
+        database.DB_PATH = self.old_db_path
+        self.tmp.cleanup()
+
+    def rows(self, **kwargs):
+        return [row for batch in database.iter_export_rows(**kwargs) for row in batch]
+
+    def test_filters_and_metadata(self):
+        rows = self.rows(statuses=["completed"], batch_size=1)
+        self.assertEqual([(r["job_id"], r["page_number"]) for r in rows],
+                         [("done", 1), ("done", 2), ("later", 1)])
+        self.assertEqual(rows[0]["original_filename"], "invoice.pdf")
+        self.assertEqual(rows[0]["used_prompt"], "Free OCR.")
+        self.assertEqual(rows[0]["job_status"], "completed")
+
+        rows = self.rows(filename="report", statuses=None)
+        self.assertEqual([r["job_id"] for r in rows], ["later"])
+
+    def test_cursor_follows_job_completion(self):
+        # The running job has the second page id but does not hold back the jobs that finished
+        bound = database.get_export_cursor_bound()
+        self.assertEqual(bound, 2)
+        first = self.rows(until=bound, statuses=["completed"])
+        self.assertEqual([(r["job_id"], r["page_number"]) for r in first],
+                         [("done", 1), ("done", 2), ("later", 1)])
+        self.assertEqual(first[0]["cursor"], "1:1")
+
+        # Once the job completes, the next incremental export picks up only its pages
+        database.save_result("running", [])
+        second = self.rows(since=bound, until=database.get_export_cursor_bound(), statuses=["completed"])
+        self.assertEqual([r["job_id"] for r in second], ["running"])
+        self.assertEqual(second[0]["cursor"], "3:2")
+
+    def test_resume_inside_a_job(self):
+        rows = self.rows(since=1, since_page=1, statuses=["completed"])
+        self.assertEqual([(r["job_id"], r["page_number"]) for r in rows], [("done", 2), ("later", 1)])
+        self.assertEqual(bulk_export.parse_cursor("1:1"), (1, 1))
+        self.assertEqual(bulk_export.parse_cursor("7"), (7, None))
+        with self.assertRaises(ValueError):
+            bulk_export.parse_cursor("x")
+
+    def test_unfinished_pages_have_no_cursor(self):
+        rows = self.rows(include_unfinished=True, batch_size=2)
+        self.assertEqual([r["job_id"] for r in rows], ["done", "done", "later", "running"])
+        self.assertIsNone(rows[-1]["cursor"])
+
+    def test_jsonl(self):
+        data = b"".join(bulk_export.iter_jsonl(database.iter_export_rows(batch_size=2, include_unfinished=True)))
+        lines = [json.loads(line) for line in data.decode("utf-8").splitlines()]
+        self.assertEqual(len(lines), 4)
+        self.assertEqual(lines[0]["content"], "page one")
+
+    @unittest.skipIf(pyarrow is None, "pyarrow not installed")
+    def test_parquet_row_groups(self):
+        import pyarrow.parquet as pq
+
+        chunks = list(bulk_export.iter_parquet(database.iter_export_rows(batch_size=2, include_unfinished=True)))
+        table_file = pq.ParquetFile(io.BytesIO(b"".join(chunks)))
+        self.assertEqual(table_file.num_row_groups, 3)  # Batches of 2 + 1 finished pages, then the unfinished one
+        table = table_file.read()
+        self.assertEqual(table.column("content").to_pylist(),
+                         ["page one", "page two", "report", "partial archive"])
+
+    @unittest.skipIf(pyarrow is None, "pyarrow not installed")
+    def test_arrow_stream(self):
+        data = b"".join(bulk_export.iter_arrow(database.iter_export_rows(batch_size=3, include_unfinished=True)))
+        table = pyarrow.ipc.open_stream(data).read_all()
+        self.assertEqual(table.num_rows, 4)
+        self.assertEqual(table.column("job_id").to_pylist()[0], "done")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -7,13 +7,14 @@ import asyncio
 import sys
 
 # Mock modules before importing ocr_service to avoid import errors or heavy loads
-sys.modules['pdf2image'] = MagicMock()
-sys.modules['deepseek_vl'] = MagicMock()
-sys.modules['deepseek_vl.models'] = MagicMock()
-sys.modules['deepseek_vl.utils.io'] = MagicMock()
-sys.modules['transformers'] = MagicMock()
-sys.modules['torch'] = MagicMock()
-sys.modules['pandas'] = MagicMock()
+# (only where missing: replacing an installed module breaks other test files)
+for name in ('pdf2image', 'deepseek_vl', 'deepseek_vl.models', 'deepseek_vl.utils.io',
+             'transformers', 'torch'):
+    sys.modules.setdefault(name, MagicMock())
+try:
+    import pandas
+except ImportError:
+    sys.modules.setdefault('pandas', MagicMock())
 
 # Now import the service
 # We need to set the environment variable for PROCESSED_DIR to a temp dir maybe, 
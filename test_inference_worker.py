@@ -0,0 +1,227 @@
+import unittest
+from unittest.mock import MagicMock, patch
+import os
+import sys
+import time
+import tempfile
+
+# Stand in for heavy modules that are not installed (no GPU / model needed);
+# never replace a module another test or the environment already provides
+for name in ('pdf2image', 'transformers', 'torch'):
+    sys.modules.setdefault(name, MagicMock())
+try:
+    import pandas
+except ImportError:
+    sys.modules.setdefault('pandas', MagicMock())
+
+from backend.services.inference_worker import SupervisedInference, InferenceTimeout, InferenceError, run_infer
+from backend.services.page_stream import PartialPageBroker, PageTextStreamer, TokenLimitExceeded
+from backend.services.model_registry import ModelRegistry, ModelSpec
+
+REGISTRY = "test_inference_worker:fake_registry"
+SETTINGS = {"dpi": 300, "base_size": 1024, "image_size": 768, "crop_mode": True}
+
+
+class FakeTokenizer:
+    def decode(self, token_ids, skip_special_tokens=True):
+        return " ".join(f"t{t}" for t in token_ids)
+
+
+class FakeModel:
+    """Behaviour is picked by the prompt, so one worker process can exercise every case."""
+
+    def infer(self, tokenizer, prompt='', image_file='', output_path='', base_size=1024,
+              image_size=640, crop_mode=True, test_compress=False, save_results=False, streamer=None):
+        if prompt == "hang" or (prompt == "hang-with-crop" and crop_mode):
+            time.sleep(60)
+        if prompt == "crash":
+            os._exit(1)
+        if prompt == "endless":
+            streamer.put([0])
+            token = 1
+            while True:
+                streamer.put([token])
+                token += 1
+        if prompt == "stream":
+            streamer.put([0])
+            for token in [1, 2, 3, 4, 5]:
+                streamer.put([token])
+            streamer.end()
+        return f"ok pid={os.getpid()} crop={crop_mode} size={image_size}"
+
+
+class RealSignatureModel:
+    """DeepSeek-OCR's real infer() signature: no streamer argument, generate() is called internally."""
+
+    def __init__(self, ignore_streamer=False):
+        self.ignore_streamer = ignore_streamer
+        self.max_new_tokens_seen = []
+
+    def generate(self, input_ids=None, streamer=None, max_new_tokens=None):
+        self.max_new_tokens_seen.append(max_new_tokens)
+        if self.ignore_streamer:
+            streamer = None
+        if streamer is not None:
+            streamer.put([[0]])  # prompt
+        # Never emits EOS: only max_new_tokens ends the generation
+        for token in range(max_new_tokens):
+            if streamer is not None:
+                streamer.put([token])
+        return list(range(max_new_tokens))
+
+    def infer(self, tokenizer, prompt='', image_file='', output_path='', base_size=1024, image_size=640,
+              crop_mode=True, test_compress=False, save_results=False, eval_mode=False):
+        output = self.generate([0], streamer=None, max_new_tokens=8192)
+        return f"ok tokens={len(output)}"
+
+
+def load_fake_model(spec, precision):
+    return FakeModel(), FakeTokenizer()
+
+
+def load_slow_model(spec, precision):
+    time.sleep(2)
+    return FakeModel(), FakeTokenizer()
+
+
+def load_real_signature_model(spec, precision):
+    return RealSignatureModel(), FakeTokenizer()
+
+
+def fake_registry():
+    return ModelRegistry([
+        ModelSpec("deepseek-ocr", "stub", loader="test_inference_worker:load_fake_model"),
+        ModelSpec("real", "stub", loader="test_inference_worker:load_real_signature_model"),
+        ModelSpec("slow", "stub", loader="test_inference_worker:load_slow_model"),
+    ], max_loaded=2)
+
+
+class TestSupervisedInference(unittest.TestCase):
+
+    def setUp(self):
+        self.broker = PartialPageBroker()
+        self.worker = SupervisedInference(REGISTRY, load_timeout=30, broker=self.broker)
+
+    def tearDown(self):
+        self.worker.stop()
+
+    def infer(self, prompt, timeout=5, max_tokens=100, model_ref=None):
+        return self.worker.infer("job", 1, "img.png", "out", prompt, SETTINGS,
+                                 timeout=timeout, max_tokens=max_tokens, model_ref=model_ref)
+
+    def test_result_and_partial_text(self):
+        self.assertTrue(self.infer("stream").startswith("ok"))
+        self.assertEqual(self.broker.get("job")["text"], "t1 t2 t3 t4 t5")
+
+    def test_timeout_restarts_worker(self):
+        first_pid = self.infer("ok").split()[1]
+        started = time.monotonic()
+        with self.assertRaises(InferenceTimeout):
+            self.infer("hang", timeout=1)
+        self.assertLess(time.monotonic() - started, 5)
+        self.assertEqual(self.worker.restarts, 1)
+
+        # The next page gets a fresh process with the model reloaded
+        self.assertNotEqual(self.infer("ok").split()[1], first_pid)
+
+    def test_token_cap_stops_endless_generation(self):
+        with self.assertRaises(TokenLimitExceeded):
+            self.infer("endless", max_tokens=50)
+        # Generation was aborted cleanly; the same process keeps serving
+        self.assertEqual(self.worker.restarts, 0)
+        self.assertTrue(self.infer("ok").startswith("ok"))
+
+    def test_model_load_is_not_billed_to_the_page(self):
+        # Loading takes 2s, longer than the page budget
+        self.assertTrue(self.infer("ok", timeout=1, model_ref="slow").startswith("ok"))
+        self.assertEqual(self.worker.restarts, 0)
+        loaded = [entry["model"] for entry in self.worker.model_metrics["loaded"]]
+        self.assertEqual(loaded, ["slow@bf16"])
+
+    def test_unknown_model_is_an_error(self):
+        with self.assertRaises(InferenceError):
+            self.infer("ok", model_ref="missing")
+        self.assertTrue(self.infer("ok").startswith("ok"))
+
+    def test_crashed_worker_is_replaced(self):
+        with self.assertRaises(InferenceError):
+            self.infer("crash")
+        self.assertTrue(self.infer("ok").startswith("ok"))
+
+
+class TestTokenCap(unittest.TestCase):
+    """The cap must hold for the real infer() signature, with or without streaming."""
+
+    def test_cap_without_streaming(self):
+        worker = SupervisedInference(REGISTRY, load_timeout=30, streaming=False, broker=PartialPageBroker())
+        try:
+            with self.assertRaises(TokenLimitExceeded):
+                worker.infer("job", 1, "img.png", "out", "p", SETTINGS, timeout=10, max_tokens=50,
+                             model_ref="real")
+        finally:
+            worker.stop()
+
+    def test_cap_with_streaming(self):
+        broker = PartialPageBroker()
+        worker = SupervisedInference(REGISTRY, load_timeout=30, broker=broker)
+        try:
+            with self.assertRaises(TokenLimitExceeded):
+                worker.infer("job", 1, "img.png", "out", "p", SETTINGS, timeout=10, max_tokens=50,
+                             model_ref="real")
+            self.assertTrue(broker.get("job")["text"].startswith("t0 t1"))
+        finally:
+            worker.stop()
+
+    def test_generate_is_capped_even_if_streamer_is_ignored(self):
+        model = RealSignatureModel(ignore_streamer=True)
+        streamer = PageTextStreamer(FakeTokenizer(), "job", 1, broker=None, max_tokens=50)
+        text = run_infer(model, FakeTokenizer(), "img.png", "out", "p", SETTINGS, streamer)
+
+        self.assertEqual(text, "ok tokens=51")
+        self.assertEqual(model.max_new_tokens_seen, [51])
+        self.assertNotIn("generate", vars(model))
+
+
+class TestDegradedRetries(unittest.TestCase):
+
+    def setUp(self):
+        from backend.services import ocr_service
+        self.ocr_service = ocr_service
+        self.tmp = tempfile.TemporaryDirectory()
+        self.old_settings = (ocr_service.PROCESSED_DIR, ocr_service.ISOLATE_INFERENCE,
+                             ocr_service.PAGE_TIMEOUT_SECONDS, ocr_service.MODEL_REGISTRY_FACTORY)
+        ocr_service.PROCESSED_DIR = self.tmp.name
+        ocr_service.ISOLATE_INFERENCE = True
+        ocr_service.PAGE_TIMEOUT_SECONDS = 1
+        ocr_service.MODEL_REGISTRY_FACTORY = REGISTRY
+
+    def tearDown(self):
+        self.ocr_service.get_supervisor().stop()
+        del self.ocr_service._supervisors.inference
+        (self.ocr_service.PROCESSED_DIR, self.ocr_service.ISOLATE_INFERENCE,
+         self.ocr_service.PAGE_TIMEOUT_SECONDS, self.ocr_service.MODEL_REGISTRY_FACTORY) = self.old_settings
+        self.tmp.cleanup()
+
+    @patch('backend.services.ocr_service.convert_from_path')
+    def test_retry_without_crop_mode(self, mock_convert):
+        mock_convert.return_value = [MagicMock()]
+        text, failed = self.ocr_service.ocr_page("job", "doc.pdf", 1, "hang-with-crop")
+
+        self.assertFalse(failed)
+        self.assertIn("crop=False size=640", text)
+        self.assertEqual([c.kwargs["dpi"] for c in mock_convert.call_args_list], [300, 200])
+
+    @patch('backend.services.ocr_service.convert_from_path')
+    def test_fatal_page_costs_bounded_time(self, mock_convert):
+        mock_convert.return_value = [MagicMock()]
+        started = time.monotonic()
+        text, failed = self.ocr_service.ocr_page("job", "doc.pdf", 1, "hang")
+
+        self.assertTrue(failed)
+        self.assertTrue(text.startswith("[Error processing page 1:"))
+        self.assertEqual(mock_convert.call_count, len(self.ocr_service.PAGE_ATTEMPTS))
+        self.assertLess(time.monotonic() - started, 30)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,33 @@
+import unittest
+import asyncio
+import time
+
+from backend.services import loop_monitor
+from backend.services.executors import run_db
+
+
+class TestLoopMonitor(unittest.IsolatedAsyncioTestCase):
+
+    async def asyncSetUp(self):
+        loop_monitor.stats.update(stalls=0, max_lag_seconds=0.0, last_lag_seconds=0.0)
+        self.task = asyncio.create_task(loop_monitor.monitor_event_loop(interval=0.01, threshold=0.1))
+        await asyncio.sleep(0.05)
+
+    async def asyncTearDown(self):
+        self.task.cancel()
+
+    async def test_blocking_call_is_reported(self):
+        with self.assertLogs(loop_monitor.logger, level="WARNING"):
+            time.sleep(0.3)  # Blocks the loop thread
+            await asyncio.sleep(0.05)
+        self.assertGreaterEqual(loop_monitor.stats["stalls"], 1)
+        self.assertGreater(loop_monitor.stats["max_lag_seconds"], 0.2)
+
+    async def test_offloaded_call_does_not_stall(self):
+        await run_db(time.sleep, 0.3)
+        await asyncio.sleep(0.05)
+        self.assertEqual(loop_monitor.stats["stalls"], 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,141 @@
+import unittest
+import threading
+
+from backend.services.model_registry import ModelRegistry, ModelSpec, BYTES_PER_PARAM
+
+
+class FakeParameter:
+    def __init__(self, count, element_size):
+        self.count = count
+        self.size = element_size
+
+    def numel(self):
+        return self.count
+
+    def element_size(self):
+        return self.size
+
+
+class StubModel:
+    """CPU stand-in for a torch module: 1M parameters at the loaded precision."""
+
+    def __init__(self, name, precision):
+        self.name = name
+        self.precision = precision
+        self._parameters = [FakeParameter(1024 ** 2, BYTES_PER_PARAM[precision])]
+
+    def parameters(self):
+        return self._parameters
+
+
+class TestModelRegistry(unittest.TestCase):
+
+    def setUp(self):
+        self.loads = []
+
+    def loader(self, spec, precision):
+        self.loads.append(f"{spec.name}@{precision}")
+        return StubModel(spec.name, precision), f"tokenizer-{spec.name}"
+
+    def registry(self, **kwargs):
+        specs = [
+            ModelSpec("deepseek-ocr", "stub", loader=self.loader, precisions=("bf16", "fp32", "int8"),
+                      params_billions=1024 ** 2 / 1e9),
+            ModelSpec("small", "stub", loader=self.loader, precisions=("fp32",)),
+            ModelSpec("tiny", "stub", loader=self.loader, precisions=("int8",)),
+        ]
+        return ModelRegistry(specs, **kwargs)
+
+    def loaded(self, registry):
+        return [entry["model"] for entry in registry.metrics()["loaded"]]
+
+    def test_resolve(self):
+        registry = self.registry()
+        self.assertEqual(registry.resolve(None), "deepseek-ocr@bf16")
+        self.assertEqual(registry.resolve("deepseek-ocr@int8"), "deepseek-ocr@int8")
+        self.assertEqual(registry.resolve("small"), "small@fp32")
+        with self.assertRaises(ValueError):
+            registry.resolve("missing")
+        with self.assertRaises(ValueError):
+            registry.resolve("small@int4")
+
+    def test_cached_model_is_reused(self):
+        registry = self.registry()
+        model, tokenizer = registry.get()
+        self.assertIs(registry.get("deepseek-ocr@bf16")[0], model)
+        self.assertEqual(tokenizer, "tokenizer-deepseek-ocr")
+        metrics = registry.metrics()
+        self.assertEqual((metrics["loads"], metrics["hits"]), (1, 1))
+        self.assertEqual(metrics["used_mb"], 2.0)
+
+    def test_precision_variants_are_separate_entries(self):
+        registry = self.registry(max_loaded=2)
+        self.assertEqual(registry.get("deepseek-ocr@int8")[0].precision, "int8")
+        self.assertEqual(registry.get("deepseek-ocr@fp32")[0].precision, "fp32")
+        self.assertEqual(self.loaded(registry), ["deepseek-ocr@int8", "deepseek-ocr@fp32"])
+
+    def test_lru_eviction_by_count(self):
+        registry = self.registry(max_loaded=2)
+        registry.get("deepseek-ocr")
+        registry.get("small")
+        registry.get("deepseek-ocr")  # now most recently used
+        registry.get("tiny")
+
+        self.assertEqual(self.loaded(registry), ["deepseek-ocr@bf16", "tiny@int8"])
+        self.assertEqual(registry.metrics()["evictions"], 1)
+
+    def test_lru_eviction_by_memory_budget(self):
+        # 4 MB fits bf16 (2 MB) + int8 (1 MB), but not fp32 (4 MB) next to anything else
+        registry = self.registry(memory_budget_mb=4, max_loaded=3)
+        registry.get("deepseek-ocr")
+        registry.get("tiny")
+        self.assertEqual(registry.metrics()["evictions"], 0)
+
+        registry.get("small")
+        self.assertEqual(self.loaded(registry), ["small@fp32"])
+        self.assertEqual(registry.metrics()["evictions"], 2)
+        self.assertEqual(registry.metrics()["used_mb"], 4.0)
+
+    def test_load_does_not_block_metrics_or_hits(self):
+        release = threading.Event()
+        started = threading.Event()
+
+        def slow(spec, precision):
+            started.set()
+            release.wait(5)
+            return StubModel(spec.name, precision), "tok"
+
+        specs = [ModelSpec("deepseek-ocr", "stub", loader=self.loader),
+                 ModelSpec("slow", "stub", loader=slow)]
+        registry = ModelRegistry(specs, max_loaded=2)
+        registry.get()
+        results = []
+        loaders = [threading.Thread(target=lambda: results.append(registry.get("slow"))) for _ in range(2)]
+        for t in loaders:
+            t.start()
+        self.assertTrue(started.wait(5))
+
+        # While "slow" loads: metrics and cached models answer immediately
+        self.assertEqual(registry.metrics()["loading"], ["slow@bf16"])
+        self.assertEqual(registry.get()[1], "tokenizer-deepseek-ocr")
+
+        release.set()
+        for t in loaders:
+            t.join(5)
+        # The second caller waited for the first load instead of loading again
+        self.assertEqual(registry.metrics()["loads"], 2)
+        self.assertIs(results[0][0], results[1][0])
+
+    def test_failed_load_is_counted(self):
+        def broken(spec, precision):
+            raise RuntimeError("no weights")
+
+        registry = ModelRegistry([ModelSpec("deepseek-ocr", "stub", loader=broken)])
+        with self.assertRaises(RuntimeError):
+            registry.get()
+        self.assertEqual(registry.metrics()["load_errors"], 1)
+        self.assertEqual(registry.metrics()["loaded"], [])
+
+
+if __name__ == '__main__':
+    unittest.main()
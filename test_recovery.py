@@ -0,0 +1,125 @@
+import unittest
+from unittest.mock import MagicMock
+import os
+import sys
+import tempfile
+
+# Mock heavy modules before importing ocr_service (no GPU / model needed)
+for name in ('pdf2image', 'transformers', 'torch'):
+    sys.modules.setdefault(name, MagicMock())
+
+from backend import database
+from backend.services import ocr_service
+from backend.services.scheduler import BULK
+
+
+class RecordingScheduler:
+    def __init__(self):
+        self.submitted = []
+
+    def submit(self, job_id, file_path, prompt, pages, priority, total_pages, **kwargs):
+        self.submitted.append((job_id, pages, priority, kwargs))
+
+
+class TestRecovery(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.old_db_path = database.DB_PATH
+        database.DB_PATH = os.path.join(self.tmp.name, "ocr.db")
+        database.init_db()
+        self.upload_dir = self.tmp.name
+
+    def tearDown(self):
+        database.DB_PATH = self.old_db_path
+        self.tmp.cleanup()
+
+    def upload(self, job_id, filename):
+        with open(os.path.join(self.upload_dir, f"{job_id}_{filename}"), "wb") as f:
+            f.write(b"%PDF")
+
+    def test_orphaned_jobs_are_requeued_or_failed(self):
+        database.create_job("half", original_filename="a.pdf", page_range="2-4", priority=BULK,
+                            total_pages=5, model="deepseek-ocr@bf16")
+        database.update_job("half", status="processing")
+        database.save_page_result("half", 2, "done before the restart")
+        self.upload("half", "a.pdf")
+
+        database.create_job("lost", original_filename="b.pdf", total_pages=1)
+        database.create_job("finished", original_filename="c.pdf", total_pages=1)
+        database.save_result("finished", [])
+
+        scheduler = RecordingScheduler()
+        self.assertEqual(ocr_service.recover_jobs(scheduler, self.upload_dir), 1)
+
+        job_id, pages, priority, kwargs = scheduler.submitted[0]
+        self.assertEqual((job_id, pages, priority), ("half", [3, 4], BULK))
+        self.assertEqual(kwargs["pages_done"], 1)
+        self.assertEqual(kwargs["model"], "deepseek-ocr@bf16")
+        self.assertFalse(kwargs["enforce_limits"])
+        self.assertEqual(database.get_job("half")["status"], "queued")
+
+        # The lost job reaches a final status, so it no longer blocks anything
+        lost = database.get_job("lost")
+        self.assertEqual(lost["status"], "error")
+        self.assertIsNotNone(lost["export_seq"])
+
+    def test_unacknowledged_cancellation_is_finalized(self):
+        database.create_job("stopped", original_filename="a.pdf", total_pages=2)
+        database.update_job("stopped", status="processing")
+        database.cancel_job("stopped")
+        self.assertIsNone(database.get_job("stopped")["export_seq"])
+
+        self.assertEqual(ocr_service.recover_jobs(RecordingScheduler(), self.upload_dir), 0)
+        stopped = database.get_job("stopped")
+        self.assertEqual((stopped["status"], stopped["export_seq"]), ("cancelled", 1))
+
+
+class TestExportSeq(unittest.TestCase):
+    """A job's export_seq is taken once; later writes of a final status must not move the cursor."""
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.old_db_path = database.DB_PATH
+        database.DB_PATH = os.path.join(self.tmp.name, "ocr.db")
+        database.init_db()
+
+    def tearDown(self):
+        database.DB_PATH = self.old_db_path
+        self.tmp.cleanup()
+
+    def test_finish_job_takes_one_seq(self):
+        database.create_job("done", original_filename="a.pdf", total_pages=1)
+        ocr_service.start_job("done", 1)
+        ocr_service.save_page("done", 1, "text", 1, 1)
+        ocr_service.finish_job("done", 1)
+
+        self.assertEqual(database.get_job("done")["export_seq"], 1)
+        self.assertEqual(database.get_export_cursor_bound(), 1)
+
+    def test_cancelled_job_takes_its_seq_when_the_worker_stops(self):
+        database.create_job("running", original_filename="a.pdf", total_pages=3)
+        ocr_service.start_job("running", 3)
+        ocr_service.save_page("running", 1, "one", 1, 3)
+
+        # Cancelled while page 2 is in inference: nothing to export until the worker stops
+        database.cancel_job("running")
+        self.assertEqual(database.get_export_cursor_bound(), 0)
+        ocr_service.save_page("running", 2, "two", 2, 3)
+        self.assertTrue(ocr_service.is_job_cancelled("running"))
+        ocr_service.mark_cancelled("running")
+
+        bound = database.get_export_cursor_bound()
+        self.assertEqual(bound, 1)
+        rows = [row for batch in database.iter_export_rows(until=bound) for row in batch]
+        self.assertEqual([r["page_number"] for r in rows], [1, 2])
+
+        # Repeated final writes keep the number, so a sync from the header cursor sends nothing again
+        ocr_service.mark_cancelled("running")
+        ocr_service.fail_job("running", "late error")
+        self.assertEqual(database.get_export_cursor_bound(), bound)
+        self.assertEqual(list(database.iter_export_rows(since=bound)), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,195 @@
+import unittest
+import threading
+
+from backend.services import scheduler as scheduler_module
+from backend.services.scheduler import (
+    JobScheduler, AdmissionLimits, AdmissionRejected, JobTooLarge, parse_page_range, resolve_priority,
+    INTERACTIVE, BULK
+)
+
+
+class FakeRunner:
+    """Records the order pages are processed in; the first page can be held back."""
+
+    def __init__(self):
+        self.order = []
+        self.finished = []
+        self.cancelled = set()
+        self.hold_first_page = threading.Event()
+        self.first_page_started = threading.Event()
+        self.all_done = threading.Event()
+        self.expected_jobs = 0
+
+    def is_job_cancelled(self, job_id):
+        return job_id in self.cancelled
+
+    def mark_cancelled(self, job_id):
+        self._job_left(job_id)
+
+    def start_job(self, job_id, total_pages):
+        pass
+
+    def ocr_page(self, job_id, file_path, page_number, prompt, model_ref=None):
+        if not self.first_page_started.is_set():
+            self.first_page_started.set()
+            self.hold_first_page.wait(5)
+        self.order.append((job_id, page_number))
+        return f"{job_id}:{page_number}", False
+
+    def save_page(self, job_id, page_number, text, pages_done, pages_total, failed=False):
+        pass
+
+    def finish_job(self, job_id, total_pages):
+        self._job_left(job_id)
+
+    def fail_job(self, job_id, error):
+        self._job_left(job_id)
+
+    def _job_left(self, job_id):
+        self.finished.append(job_id)
+        if len(self.finished) == self.expected_jobs:
+            self.all_done.set()
+
+
+class TestPageRange(unittest.TestCase):
+
+    def test_parse(self):
+        self.assertEqual(parse_page_range(None, 3), [1, 2, 3])
+        self.assertEqual(parse_page_range("1-3,7,9-", 10), [1, 2, 3, 7, 9, 10])
+        self.assertEqual(parse_page_range("2, 2-3", 5), [2, 3])
+        self.assertEqual(parse_page_range("4-99", 5), [4, 5])
+
+    def test_invalid(self):
+        for spec in ["0", "5-2", "abc", "11", ","]:
+            with self.assertRaises(ValueError):
+                parse_page_range(spec, 10)
+
+    def test_priority(self):
+        self.assertEqual(resolve_priority(None, 2), INTERACTIVE)
+        self.assertEqual(resolve_priority(None, 1500), BULK)
+        self.assertEqual(resolve_priority(BULK, 2), BULK)
+        with self.assertRaises(ValueError):
+            resolve_priority("urgent", 2)
+
+
+class TestJobScheduler(unittest.TestCase):
+
+    def setUp(self):
+        self.runner = FakeRunner()
+        self.scheduler = JobScheduler(runner=self.runner, num_workers=1)
+
+    def test_interactive_preempts_bulk_between_pages(self):
+        self.runner.expected_jobs = 2
+        self.scheduler.submit("bulk", "a.pdf", None, [1, 2, 3, 4], BULK, 4)
+        self.assertTrue(self.runner.first_page_started.wait(5))
+
+        self.scheduler.submit("invoice", "b.pdf", None, [1, 2], INTERACTIVE, 2)
+        self.runner.hold_first_page.set()
+        self.assertTrue(self.runner.all_done.wait(5))
+
+        self.assertEqual(self.runner.order, [
+            ("bulk", 1), ("invoice", 1), ("invoice", 2), ("bulk", 2), ("bulk", 3), ("bulk", 4),
+        ])
+        stats = self.scheduler.stats()
+        self.assertEqual(stats[INTERACTIVE]["waits_recorded"], 1)
+        self.assertEqual(stats[BULK]["waits_recorded"], 1)
+        self.assertEqual(stats[BULK]["jobs"], 0)
+
+    def test_preview_pages_run_in_interactive_lane(self):
+        self.runner.expected_jobs = 2
+        self.scheduler.submit("archive", "a.pdf", None, [1, 2, 3], BULK, 3)
+        self.assertTrue(self.runner.first_page_started.wait(5))
+
+        self.scheduler.submit("preview", "b.pdf", None, [1, 2, 3, 4], BULK, 4, preview_pages=2)
+        self.runner.hold_first_page.set()
+        self.assertTrue(self.runner.all_done.wait(5))
+
+        # Preview pages jump ahead, the rest queues behind the earlier bulk job
+        self.assertEqual(self.runner.order, [
+            ("archive", 1), ("preview", 1), ("preview", 2),
+            ("archive", 2), ("archive", 3), ("preview", 3), ("preview", 4),
+        ])
+
+    def submit_mixed_models(self):
+        self.runner.expected_jobs = 3
+        self.scheduler.submit("a", "a.pdf", None, [1, 2], BULK, 2, model="m1@bf16")
+        self.assertTrue(self.runner.first_page_started.wait(5))
+        self.scheduler.submit("b", "b.pdf", None, [1], BULK, 1, model="m2@bf16")
+        self.scheduler.submit("c", "c.pdf", None, [1], BULK, 1, model="m1@bf16")
+        self.runner.hold_first_page.set()
+        self.assertTrue(self.runner.all_done.wait(5))
+
+    def test_worker_prefers_loaded_model(self):
+        self.submit_mixed_models()
+        self.assertEqual(self.runner.order, [("a", 1), ("a", 2), ("c", 1), ("b", 1)])
+
+    def test_model_affinity_is_bounded(self):
+        old_max_wait = scheduler_module.MODEL_AFFINITY_MAX_WAIT
+        scheduler_module.MODEL_AFFINITY_MAX_WAIT = 0
+        try:
+            self.submit_mixed_models()
+        finally:
+            scheduler_module.MODEL_AFFINITY_MAX_WAIT = old_max_wait
+        self.assertEqual(self.runner.order, [("a", 1), ("a", 2), ("b", 1), ("c", 1)])
+
+    def test_cancelled_job_leaves_queue(self):
+        self.runner.expected_jobs = 1
+        self.runner.hold_first_page.set()
+        self.runner.cancelled.add("gone")
+        self.scheduler.submit("gone", "a.pdf", None, [1, 2], BULK, 2)
+        self.assertTrue(self.runner.all_done.wait(5))
+        self.assertEqual(self.runner.order, [])
+
+
+class TestAdmission(unittest.TestCase):
+
+    def setUp(self):
+        # The first page is held until tearDown, so the queue stays as submitted
+        self.runner = FakeRunner()
+        limits = AdmissionLimits(max_queued_pages=10, max_queued_bytes=1000, max_jobs_per_client=2)
+        self.scheduler = JobScheduler(runner=self.runner, num_workers=1, limits=limits)
+
+    def tearDown(self):
+        self.runner.hold_first_page.set()
+
+    def test_page_limit(self):
+        self.scheduler.submit("a", "a.pdf", None, list(range(1, 9)), BULK, 8, client_id="x")
+        with self.assertRaises(AdmissionRejected) as ctx:
+            self.scheduler.submit("b", "b.pdf", None, [1, 2, 3, 4], BULK, 4, client_id="y")
+        self.assertGreaterEqual(ctx.exception.retry_after, 1)
+        self.assertIsNone(self.scheduler.estimate("b"))
+
+    def test_byte_limit(self):
+        self.scheduler.submit("a", "a.pdf", None, [1], BULK, 1, client_id="x", file_bytes=900)
+        with self.assertRaises(AdmissionRejected):
+            self.scheduler.submit("b", "b.pdf", None, [1], BULK, 1, client_id="y", file_bytes=200)
+
+    def test_oversized_job_is_rejected_permanently(self):
+        with self.assertRaises(JobTooLarge):
+            self.scheduler.submit("big", "a.pdf", None, list(range(1, 12)), BULK, 11)
+        with self.assertRaises(JobTooLarge):
+            self.scheduler.submit("fat", "a.pdf", None, [1], BULK, 1, file_bytes=5000)
+        self.assertEqual(self.scheduler.stats()[BULK]["jobs"], 0)
+
+    def test_per_client_limit(self):
+        self.scheduler.submit("a", "a.pdf", None, [1], BULK, 1, client_id="x")
+        self.scheduler.submit("b", "b.pdf", None, [1], BULK, 1, client_id="x")
+        with self.assertRaises(AdmissionRejected):
+            self.scheduler.check_admission("x")
+        self.scheduler.check_admission("y")
+
+    def test_estimates_follow_priority(self):
+        self.scheduler.submit("bulk", "a.pdf", None, [1, 2, 3, 4], BULK, 4)
+        self.assertTrue(self.runner.first_page_started.wait(5))
+        _, bulk2 = self.scheduler.submit("bulk2", "b.pdf", None, [1, 2], BULK, 2)
+        _, interactive = self.scheduler.submit("inv", "c.pdf", None, [1], INTERACTIVE, 1)
+
+        # Interactive only waits for the page in flight; bulk waits for the whole bulk job
+        self.assertEqual(interactive["pages_ahead"], 1)
+        self.assertEqual(bulk2["pages_ahead"], 4)
+        self.assertLess(interactive["estimated_finish_seconds"], bulk2["estimated_start_seconds"])
+        self.assertEqual(self.scheduler.estimate("bulk2")["pages_ahead"], 5)
+
+
+if __name__ == '__main__':
+    unittest.main()
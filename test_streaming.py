@@ -0,0 +1,160 @@
+import unittest
+from unittest.mock import MagicMock, patch
+import os
+import sys
+import tempfile
+
+# Stand in for heavy modules that are not installed (no GPU / model needed);
+# never replace a module another test or the environment already provides
+for name in ('pdf2image', 'transformers', 'torch'):
+    sys.modules.setdefault(name, MagicMock())
+try:
+    import pandas
+except ImportError:
+    sys.modules.setdefault('pandas', MagicMock())
+
+from backend import database
+from backend.services import ocr_service
+from backend.services.page_stream import broker, PageTextStreamer, PartialPageBroker
+from backend.services.model_registry import ModelRegistry, ModelSpec
+
+
+class FakeTokenizer:
+    """Token ids are indexes into a fixed vocabulary."""
+    vocab = ["<prompt>", "Hello", " ", "world", "!", "\n"]
+
+    def __init__(self):
+        self.decoded_lengths = []
+
+    def decode(self, token_ids, skip_special_tokens=True):
+        self.decoded_lengths.append(len(token_ids))
+        return "".join(self.vocab[t] for t in token_ids)
+
+
+class FakeStreamingModel:
+    """Mimics model.infer() driving a generate() loop with a streamer."""
+
+    def __init__(self, test_case, job_id):
+        self.test_case = test_case
+        self.job_id = job_id
+        self.partials_seen = []
+
+    def infer(self, tokenizer, prompt='', image_file='', output_path='', base_size=1024,
+              image_size=640, crop_mode=True, test_compress=False, save_results=False,
+              streamer=None):
+        streamer.put([[0]])  # prompt tokens, skipped by the streamer
+        for token in [1, 2, 3, 4]:
+            streamer.put([token])
+            partial = broker.get(self.job_id)
+            self.partials_seen.append(partial["text"])
+            # Nothing is committed while the page is still being generated
+            self.test_case.assertEqual(database.get_job_pages(self.job_id), [])
+        streamer.end()
+        return tokenizer.decode([1, 2, 3, 4])
+
+
+class FakeDeepSeekModel:
+    """Real DeepSeek-OCR infer() signature: no streamer argument, generate() is called internally."""
+
+    def __init__(self):
+        self.own_streamer = MagicMock()
+
+    def generate(self, input_ids=None, streamer=None, max_new_tokens=None):
+        streamer.put([[0]])
+        for token in [1, 2, 3, 4]:
+            streamer.put([token])
+        streamer.end()
+        return [[1, 2, 3, 4]]
+
+    def infer(self, tokenizer, prompt='', image_file='', output_path='', base_size=1024,
+              image_size=640, crop_mode=True, test_compress=False, save_results=False, eval_mode=False):
+        output = self.generate([0], streamer=self.own_streamer, max_new_tokens=8192)
+        return tokenizer.decode(output[0])
+
+
+class TestPageStreaming(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.old_db_path = database.DB_PATH
+        database.DB_PATH = os.path.join(self.tmp.name, "ocr.db")
+        database.init_db()
+        self.old_settings = (ocr_service.PROCESSED_DIR, ocr_service.ISOLATE_INFERENCE)
+        ocr_service.PROCESSED_DIR = self.tmp.name
+        ocr_service.ISOLATE_INFERENCE = False  # Fake model runs in-process
+
+    def tearDown(self):
+        ocr_service._registry = None
+        database.DB_PATH = self.old_db_path
+        ocr_service.PROCESSED_DIR, ocr_service.ISOLATE_INFERENCE = self.old_settings
+        self.tmp.cleanup()
+
+    def test_streamer_publishes_partial_text(self):
+        local_broker = PartialPageBroker()
+        streamer = PageTextStreamer(FakeTokenizer(), "job", 3, broker=local_broker)
+        streamer.put([[0]])
+        self.assertIsNone(local_broker.get("job"))
+
+        streamer.put([1])
+        streamer.put([2, 3])
+        self.assertEqual(local_broker.get("job")["text"], "Hello world")
+        self.assertEqual(local_broker.get("job")["page"], 3)
+        self.assertEqual(local_broker.get("job")["version"], 2)
+
+    def test_streamer_decodes_only_the_current_line(self):
+        local_broker = PartialPageBroker()
+        tokenizer = FakeTokenizer()
+        streamer = PageTextStreamer(tokenizer, "job", 1, broker=local_broker)
+        streamer.put([[0]])
+        for _ in range(50):
+            for token in [1, 2, 3, 5]:
+                streamer.put([token])
+        streamer.end()
+
+        self.assertEqual(streamer.text, "Hello world\n" * 50)
+        self.assertEqual(local_broker.get("job")["text"], streamer.text)
+        # The decode window resets at every newline instead of growing with the page
+        self.assertLessEqual(max(tokenizer.decoded_lengths), 4)
+
+    def test_streamer_hooks_generate_for_real_infer_signature(self):
+        local_broker = PartialPageBroker()
+        model = FakeDeepSeekModel()
+        streamer = PageTextStreamer(FakeTokenizer(), "job", 1, broker=local_broker)
+
+        text = ocr_service.run_infer(model, FakeTokenizer(), "img.png", self.tmp.name, "p",
+                                     ocr_service.PAGE_ATTEMPTS[0], streamer)
+
+        self.assertEqual(text, "Hello world!")
+        self.assertEqual(local_broker.get("job")["text"], "Hello world!")
+        model.own_streamer.put.assert_not_called()
+        self.assertNotIn("generate", vars(model))
+
+    def test_supports_streamer(self):
+        def plain_infer(tokenizer, prompt=''):
+            pass
+
+        self.assertTrue(ocr_service.supports_streamer(FakeStreamingModel(self, "x").infer))
+        self.assertFalse(ocr_service.supports_streamer(plain_infer))
+
+    @patch('backend.services.ocr_service.convert_from_path')
+    @patch('backend.services.ocr_service.pdf2image.pdfinfo_from_path')
+    def test_page_committed_only_when_complete(self, mock_pdfinfo, mock_convert):
+        job_id = "stream_job"
+        database.create_job(job_id, original_filename="doc.pdf")
+        mock_pdfinfo.return_value = {"Pages": 1}
+        mock_convert.return_value = [MagicMock()]
+
+        fake_model = FakeStreamingModel(self, job_id)
+        ocr_service._registry = ModelRegistry([
+            ModelSpec("deepseek-ocr", "stub", loader=lambda spec, precision: (fake_model, FakeTokenizer())),
+        ])
+
+        ocr_service.process_pdf_background(job_id, "doc.pdf")
+
+        self.assertEqual(fake_model.partials_seen, ["Hello", "Hello ", "Hello world", "Hello world!"])
+        self.assertEqual(database.get_job_pages(job_id), [{"page_number": 1, "content": "Hello world!"}])
+        self.assertIsNone(broker.get(job_id))
+
+
+if __name__ == '__main__':
+    unittest.main()
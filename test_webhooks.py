@@ -0,0 +1,153 @@
+import unittest
+import os
+import json
+import time
+import tempfile
+import threading
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+from backend import database
+from backend.services import webhooks
+
+
+class StubReceiver(BaseHTTPRequestHandler):
+    """Answers with the next queued status code (200 once the queue is empty)."""
+    statuses = []
+    received = []
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers["Content-Length"]))
+        StubReceiver.received.append((self.headers, body))
+        status = StubReceiver.statuses.pop(0) if StubReceiver.statuses else 200
+        self.send_response(status)
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+
+class TestWebhooks(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.old_db_path = database.DB_PATH
+        database.DB_PATH = os.path.join(self.tmp.name, "ocr.db")
+        database.init_db()
+
+        StubReceiver.statuses = []
+        StubReceiver.received = []
+        self.server = HTTPServer(("127.0.0.1", 0), StubReceiver)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.url = f"http://127.0.0.1:{self.server.server_port}/hook"
+        # The stub receiver is on loopback, which the default host policy blocks
+        webhooks.ALLOW_PRIVATE_HOSTS = True
+
+        self.dispatcher = webhooks.WebhookDispatcher(
+            secret="s3cret", concurrency=2, max_attempts=3, backoff_base=0.05, poll_seconds=0.02)
+        self.old_dispatcher = webhooks.dispatcher
+        webhooks.dispatcher = self.dispatcher
+        self.dispatcher.start()
+
+    def tearDown(self):
+        webhooks.ALLOW_PRIVATE_HOSTS = False
+        webhooks.ALLOWED_HOSTS = []
+        self.dispatcher.stop()
+        webhooks.dispatcher = self.old_dispatcher
+        self.server.shutdown()
+        self.server.server_close()
+        database.DB_PATH = self.old_db_path
+        self.tmp.cleanup()
+
+    def wait_for(self, condition, timeout=5):
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            if condition():
+                return True
+            time.sleep(0.02)
+        return False
+
+    def test_signed_delivery(self):
+        database.create_job("job1", original_filename="a.pdf", webhook_url=self.url)
+        database.save_result("job1", [])
+        webhooks.notify("job1", webhooks.JOB_COMPLETED)
+
+        self.assertTrue(self.wait_for(lambda: self.dispatcher.snapshot()["delivered"] == 1))
+        headers, body = StubReceiver.received[0]
+        payload = json.loads(body)
+        self.assertEqual(payload["event"], "job.completed")
+        self.assertEqual(payload["status"], "completed")
+        self.assertEqual(headers["X-OCR-Event"], "job.completed")
+        expected = webhooks.sign("s3cret", headers["X-OCR-Timestamp"], body)
+        self.assertEqual(headers["X-OCR-Signature"], f"sha256={expected}")
+        self.assertEqual(database.get_webhook_counts(), {"delivered": 1})
+
+    def test_page_events_are_opt_in(self):
+        database.create_job("job1", webhook_url=self.url)
+        webhooks.notify("job1", webhooks.PAGE_COMPLETED, page_number=1)
+        self.assertEqual(database.get_webhook_counts(), {})
+
+        database.create_job("job2", webhook_url=self.url, webhook_events="page.completed")
+        webhooks.notify("job2", webhooks.PAGE_COMPLETED, page_number=1)
+        self.assertTrue(self.wait_for(lambda: len(StubReceiver.received) == 1))
+        self.assertEqual(json.loads(StubReceiver.received[0][1])["page_number"], 1)
+
+    def test_retries_with_backoff_then_succeeds(self):
+        StubReceiver.statuses = [500, 503]
+        database.create_job("job1", webhook_url=self.url)
+        webhooks.notify("job1", webhooks.JOB_FAILED, error="boom")
+
+        self.assertTrue(self.wait_for(lambda: self.dispatcher.snapshot()["delivered"] == 1))
+        metrics = self.dispatcher.snapshot()
+        self.assertEqual(metrics["failed_attempts"], 2)
+        self.assertEqual(metrics["retries_scheduled"], 2)
+        self.assertEqual(len(StubReceiver.received), 3)
+        # Every attempt carries the same delivery id
+        self.assertEqual({h["X-OCR-Delivery"] for h, _ in StubReceiver.received}, {"1"})
+
+    def test_dead_after_max_attempts(self):
+        StubReceiver.statuses = [500, 500, 500]
+        database.create_job("job1", webhook_url=self.url)
+        webhooks.notify("job1", webhooks.JOB_CANCELLED)
+
+        self.assertTrue(self.wait_for(lambda: self.dispatcher.snapshot()["dead"] == 1))
+        self.assertEqual(database.get_webhook_counts(), {"dead": 1})
+
+    def test_private_and_unlisted_hosts_are_rejected(self):
+        webhooks.ALLOW_PRIVATE_HOSTS = False
+        for url in ("http://169.254.169.254/latest/meta-data", "http://127.0.0.1:8000/", "http://10.1.2.3/",
+                    "http://[::1]/", "http://localhost/"):
+            with self.assertRaises(webhooks.WebhookBlocked, msg=url):
+                webhooks.validate_url(url)
+
+        webhooks.ALLOWED_HOSTS = [".example.com"]
+        with self.assertRaises(webhooks.WebhookBlocked):
+            webhooks.validate_url("https://evil.test/hook")
+
+    def test_blocked_at_delivery_is_not_retried(self):
+        # Accepted at upload, but the policy no longer allows the host when it is delivered
+        database.create_job("job1", webhook_url=self.url)
+        webhooks.ALLOW_PRIVATE_HOSTS = False
+        webhooks.notify("job1", webhooks.JOB_COMPLETED)
+
+        self.assertTrue(self.wait_for(lambda: self.dispatcher.snapshot()["blocked"] == 1))
+        self.assertEqual(database.get_webhook_counts(), {"dead": 1})
+        self.assertEqual(StubReceiver.received, [])
+
+    def test_finished_rows_are_pruned(self):
+        database.create_job("job1", webhook_url=self.url)
+        webhooks.notify("job1", webhooks.JOB_COMPLETED)
+        webhooks.notify("job1", webhooks.JOB_FAILED)
+        self.assertTrue(self.wait_for(lambda: self.dispatcher.snapshot()["delivered"] == 2))
+
+        self.assertEqual(database.prune_webhooks("2000-01-01 00:00:00"), 0)
+        self.assertEqual(database.prune_webhooks("2999-01-01 00:00:00"), 2)
+        self.assertEqual(database.get_webhook_counts(), {})
+
+    def test_backoff_is_capped(self):
+        self.assertEqual(webhooks.backoff_seconds(1, base=2, cap=600), 2)
+        self.assertEqual(webhooks.backoff_seconds(4, base=2, cap=600), 16)
+        self.assertEqual(webhooks.backoff_seconds(20, base=2, cap=600), 600)
+
+
+if __name__ == '__main__':
+    unittest.main()